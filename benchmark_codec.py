@@ -0,0 +1,79 @@
+import json
+import os
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from removebg import RemoveBgDTO, encode_image, parse_command, remove_background, resolve_path
+from removebg.func import list_images
+
+# 名称 => encode_image 参数
+CODECS = {
+    'png-1': {'output_format': 'png', 'png_compress_level': 1},
+    'png-6': {'output_format': 'png', 'png_compress_level': 6},
+    'png-9': {'output_format': 'png', 'png_compress_level': 9},
+    'png-6-rle': {'output_format': 'png', 'png_compress_level': 6, 'png_strategy': 'rle'},
+    'png-6-filtered': {'output_format': 'png', 'png_compress_level': 6, 'png_strategy': 'filtered'},
+    'webp-lossless': {'output_format': 'webp', 'quality': 50},
+    'webp-lossy-80': {'output_format': 'webp-lossy', 'quality': 80},
+    'webp-lossy-90': {'output_format': 'webp-lossy', 'quality': 90},
+}
+
+
+def manual():
+    print("Usage: python benchmark_codec.py [IMAGE_DIR]")
+    print("Report bytes and milliseconds per output codec on the removebg results of IMAGE_DIR, default example")
+    print("Options Supported:")
+    print("\t--repeat=N\t\t\toptional, encodes per codec and image, default 3")
+    print("\t--output=REPORT_PATH\t\toptional, save the report as json")
+    print("\t-raw\t\t\t\toptional, encode the images as they are instead of removing the background first")
+
+
+def _load_result(path: str, raw: bool) -> Image.Image:
+    if raw:
+        return Image.open(path).convert('RGBA')
+    code, msg, result, _ = remove_background(RemoveBgDTO(path=path, responseFormat=1))
+    if code != 0:
+        raise RuntimeError(f"remove background of {path} failed: {msg}")
+    # 命中结果缓存时得到的是缓存条目，内容是已编码的 PNG
+    return result if isinstance(result, Image.Image) else Image.open(BytesIO(result.value)).convert('RGBA')
+
+
+def run_benchmark(image_dir: str, repeat: int = 3, raw: bool = False) -> dict:
+    rows = []
+    for path in list_images(image_dir):
+        image = _load_result(path, raw)
+        for codec, params in CODECS.items():
+            timings = []
+            size = 0
+            for _ in range(repeat):
+                start = time.perf_counter()
+                size = len(encode_image(image, **params))
+                timings.append((time.perf_counter() - start) * 1000)
+            rows.append({'image': os.path.basename(path), 'size': f"{image.size[0]}x{image.size[1]}",
+                         'codec': codec, 'bytes': size, 'ms': round(min(timings), 1)})
+            print(f"{os.path.basename(path)}\t{codec:<15}\t{size:>10} bytes\t{min(timings):>8.1f}ms")
+
+    summary = {}
+    for codec in CODECS:
+        codec_rows = [row for row in rows if row['codec'] == codec]
+        if codec_rows:
+            summary[codec] = {'bytes': sum(row['bytes'] for row in codec_rows),
+                              'ms': round(sum(row['ms'] for row in codec_rows), 1)}
+    return {'images': rows, 'total': summary}
+
+
+if __name__ == "__main__":
+    args = parse_command()
+    if 'help' in args.options or len(args.arguments) > 1:
+        manual()
+        sys.exit(1)
+    image_dir = resolve_path(args.arguments[0] if args.arguments else 'example')
+    report = run_benchmark(image_dir, int(args.parameters.get('repeat', 3)), 'raw' in args.options)
+    for codec, total in report['total'].items():
+        print(f"total\t{codec:<15}\t{total['bytes']:>10} bytes\t{total['ms']:>8.1f}ms")
+    if 'output' in args.parameters:
+        with open(resolve_path(args.parameters['output']), 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
@@ -0,0 +1,91 @@
+import json
+import multiprocessing
+import sys
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from removebg import parse_command, resolve_path
+from removebg.backend import MODEL_INPUT_SIZE
+from removebg.composite import composite_rgba, mask_to_uint8
+from removebg.func import measure_in_subprocess
+
+# 模型 d1 输出的分辨率
+LOGITS_SIZE = (512, 512)
+
+
+def manual():
+    print("Usage: python benchmark_composite.py [MEGAPIXELS ...]")
+    print("Compare time and peak memory of mask post-processing + RGBA compositing, default 12 24 50 megapixels")
+    print("Options Supported:")
+    print("\t--repeat=N\t\t\toptional, runs per case, default 3")
+    print("\t--output=REPORT_PATH\t\toptional, save the report as json")
+
+
+def _float_composite(image: Image.Image, logits: torch.Tensor) -> Image.Image:
+    # 原来的流程：logits 放大到原图尺寸后 sigmoid，在原图尺寸上做浮点归一化，再用 PIL paste 合成
+    height, width = image.size[1], image.size[0]
+    mask = torch.sigmoid(F.interpolate(logits, size=(height, width), mode='bilinear'))
+    mask = torch.squeeze(mask, 0)
+    ma = torch.max(mask)
+    mi = torch.min(mask)
+    mask = (mask - mi) / (ma - mi)
+    mask_array = np.squeeze((mask * 255).permute(1, 2, 0).cpu().data.numpy().astype(np.uint8))
+    del mask
+    pil_mask = Image.fromarray(mask_array)
+    no_bg_image = Image.new("RGBA", pil_mask.size, (0, 0, 0, 0))
+    no_bg_image.paste(image, mask=pil_mask)
+    return no_bg_image
+
+
+def _uint8_composite(image: Image.Image, logits: torch.Tensor) -> Image.Image:
+    # 现在的流程：在模型分辨率上 sigmoid 和归一化，uint8 放大后直接写入 RGBA 缓冲区
+    height, width = image.size[1], image.size[0]
+    mask = torch.sigmoid(F.interpolate(logits, size=tuple(MODEL_INPUT_SIZE), mode='bilinear'))
+    return composite_rgba(image, mask_to_uint8(mask, (height, width)))
+
+
+PIPELINES = {'float': _float_composite, 'uint8': _uint8_composite}
+
+
+def _build_case(pipeline: str, megapixels: float):
+    # 在子进程中准备输入，返回 (待测函数, 输入尺寸)
+    torch.set_num_threads(1)
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+    logits = torch.from_numpy(rng.standard_normal((1, 1, *LOGITS_SIZE), dtype=np.float32))
+    return lambda: PIPELINES[pipeline](image, logits), f"{width}x{height}"
+
+
+def run_benchmark(megapixels_list: list[float], repeat: int = 3) -> list[dict]:
+    rows = []
+    for megapixels in megapixels_list:
+        for pipeline in PIPELINES:
+            row = {'pipeline': pipeline, 'megapixels': megapixels,
+                   **measure_in_subprocess(_build_case, (pipeline, megapixels), repeat)}
+            rows.append(row)
+            print(f"{row['megapixels']:>5}MP {row['size']:>11}\t{pipeline:<6}\t{row['ms']:>8.1f}ms"
+                  f"\tpeak +{row['peakMb']:.0f}MB")
+    return rows
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    args = parse_command()
+    if 'help' in args.options:
+        manual()
+        sys.exit(0)
+    try:
+        megapixels_list = [float(arg) for arg in args.arguments] or [12, 24, 50]
+        repeat = int(args.parameters.get('repeat', 3))
+    except ValueError:
+        manual()
+        sys.exit(1)
+    report = run_benchmark(megapixels_list, repeat)
+    if 'output' in args.parameters:
+        with open(resolve_path(args.parameters['output']), 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
@@ -0,0 +1,263 @@
+import base64
+import datetime
+import functools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import psutil
+
+from removebg import get_executable_directory, parse_command, resolve_path
+from removebg.func import list_images
+
+REQUEST_KINDS = ('path', 'base64', 'url')
+
+
+def manual():
+    print("Usage: python benchmark_server.py [IMAGE_DIR]")
+    print("Start the server locally and report throughput and p50/p95/p99 latency of POST /removebg "
+          "at several concurrency levels, images from IMAGE_DIR, default example")
+    print("Options Supported:")
+    print("\t--concurrency=1,4,16\t\toptional, concurrent clients per level, default 1,4,16")
+    print("\t--requests=N\t\t\toptional, requests per level, default 4 x concurrency and at least 20")
+    print("\t--mix=path:1,base64:1,url:1\toptional, weights of path / base64 / url requests")
+    print("\t--warmup=N\t\t\toptional, sequential requests before the first level, default 2")
+    print("\t--server=URL\t\t\toptional, benchmark a running server instead of starting start.py")
+    print("\t--startup-timeout=SECONDS\toptional, wait for the server to be ready, default 300")
+    print("\t--output=REPORT_PATH\t\toptional, save the report as json")
+    print("\t-cache\t\t\t\toptional, keep the result cache enabled, by default every request is inferred")
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_image_server(image_dir: str) -> ThreadingHTTPServer:
+    """
+    启动本地静态文件服务，代替 url 请求中的外部图片源站
+    """
+    handler = functools.partial(_QuietHandler, directory=image_dir)
+    httpd = ThreadingHTTPServer(('127.0.0.1', _free_port()), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def start_app(port: int, keep_cache: bool) -> subprocess.Popen:
+    """
+    以子进程运行 start.py，配置（.env）与线上一致，只替换端口，默认关闭结果缓存
+    """
+    env = dict(os.environ, HTTP_SERVER_PORT=str(port))
+    if not keep_cache:
+        env.update(RESULT_CACHE_MEMORY_MB='0', RESULT_CACHE_DIR='', MASK_CACHE_MB='0')
+    root = get_executable_directory()
+    return subprocess.Popen([sys.executable, os.path.join(root, 'start.py')], cwd=root, env=env,
+                            stdin=subprocess.DEVNULL)
+
+
+def stop_app(process: subprocess.Popen):
+    # uvicorn 收到 SIGTERM 后不会执行 atexit，共享推理进程需要单独结束
+    children = psutil.Process(process.pid).children(recursive=True)
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    _, alive = psutil.wait_procs(children, timeout=10)
+    for child in alive:
+        child.kill()
+
+
+def wait_ready(server: str, process: subprocess.Popen | None, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"{server}/status", timeout=5) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(1)
+    raise RuntimeError(f"server not ready in {timeout} seconds")
+
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for item in value.split(','):
+        kind, _, weight = item.partition(':')
+        kind = kind.strip()
+        if kind not in REQUEST_KINDS:
+            raise ValueError(f"unknown request kind: {kind}")
+        mix[kind] = int(weight or 1)
+    if sum(mix.values()) <= 0:
+        raise ValueError("mix weights must not all be 0")
+    return mix
+
+
+def build_workload(image_paths: list[str], mix: dict[str, int], image_base_url: str) -> list[tuple[str, bytes]]:
+    """
+    按权重交替生成请求体，请求时循环使用
+    :return: [(请求类型, JSON 请求体)]
+    """
+    bodies = {kind: [] for kind in REQUEST_KINDS}
+    for path in image_paths:
+        bodies['path'].append({'path': os.path.abspath(path)})
+        with open(path, 'rb') as file:
+            bodies['base64'].append({'base64': base64.b64encode(file.read()).decode('ascii')})
+        bodies['url'].append({'url': f"{image_base_url}/{urllib.parse.quote(os.path.basename(path))}"})
+
+    kinds = [kind for kind, weight in mix.items() for _ in range(weight)]
+    workload = []
+    for i in range(len(kinds) * len(image_paths)):
+        kind = kinds[i % len(kinds)]
+        workload.append((kind, json.dumps(bodies[kind][i // len(kinds) % len(image_paths)]).encode('utf-8')))
+    return workload
+
+
+def send(server: str, body: bytes) -> tuple[str, float]:
+    """
+    :return: (结果：ok / rejected（503）/ failed, 耗时毫秒)
+    """
+    request = urllib.request.Request(f"{server}/removebg", data=body, method='POST',
+                                      headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=600) as response:
+            content = json.loads(response.read())
+            status = 'ok' if content.get('code') == 0 else 'failed'
+    except urllib.error.HTTPError as e:
+        status = 'rejected' if e.code == 503 else 'failed'
+    except (urllib.error.URLError, OSError, ValueError):
+        status = 'failed'
+    return status, (time.perf_counter() - start) * 1000
+
+
+def _latency_stats(latencies: list[float]) -> dict:
+    if not latencies:
+        return {'p50': None, 'p95': None, 'p99': None, 'mean': None, 'max': None}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {'p50': round(float(p50), 1), 'p95': round(float(p95), 1), 'p99': round(float(p99), 1),
+            'mean': round(float(np.mean(latencies)), 1), 'max': round(float(np.max(latencies)), 1)}
+
+
+def run_level(server: str, workload: list[tuple[str, bytes]], concurrency: int, total: int) -> dict:
+    """
+    以 concurrency 个客户端闭环发送 total 个请求，每个客户端收到响应后立即发送下一个
+    """
+    results = []
+    results_lock = threading.Lock()
+    counter = iter(range(total))
+
+    def client():
+        while True:
+            with results_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            kind, body = workload[i % len(workload)]
+            status, ms = send(server, body)
+            with results_lock:
+                results.append((kind, status, ms))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    elapsed = time.perf_counter() - start
+
+    # 延迟只统计成功的请求，503 会立即返回，计入会拉低延迟
+    ok = [ms for _, status, ms in results if status == 'ok']
+    row = {'concurrency': concurrency, 'requests': total, 'ok': len(ok),
+           'rejected': sum(1 for _, status, _ in results if status == 'rejected'),
+           'failed': sum(1 for _, status, _ in results if status == 'failed'),
+           'seconds': round(elapsed, 2), 'rps': round(len(ok) / elapsed, 2), **_latency_stats(ok)}
+    row['byKind'] = {kind: {'ok': len(kind_ok), **_latency_stats(kind_ok)}
+                     for kind in REQUEST_KINDS
+                     if (kind_ok := [ms for k, status, ms in results if k == kind and status == 'ok'])}
+    return row
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=get_executable_directory(), capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(server: str, image_dir: str, concurrency_levels: list[int], requests: int | None,
+                  mix: dict[str, int], warmup: int) -> dict:
+    image_paths = list_images(image_dir)
+    if not image_paths:
+        raise RuntimeError(f"no image found in {image_dir}")
+    image_server = start_image_server(image_dir)
+    try:
+        image_base_url = f"http://127.0.0.1:{image_server.server_address[1]}"
+        workload = build_workload(image_paths, mix, image_base_url)
+        for i in range(warmup):
+            send(server, workload[i % len(workload)][1])
+
+        levels = []
+        for concurrency in concurrency_levels:
+            row = run_level(server, workload, concurrency, requests or max(20, concurrency * 4))
+            levels.append(row)
+            print(f"c={concurrency:<4}\t{row['rps']:>7.2f} req/s\tp50 {row['p50']}ms\tp95 {row['p95']}ms"
+                  f"\tp99 {row['p99']}ms\tok {row['ok']}, rejected {row['rejected']}, failed {row['failed']}",
+                  flush=True)
+    finally:
+        image_server.shutdown()
+    return {'commit': _git_commit(), 'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'images': len(image_paths), 'mix': mix, 'levels': levels}
+
+
+if __name__ == "__main__":
+    args = parse_command()
+    if 'help' in args.options or len(args.arguments) > 1:
+        manual()
+        sys.exit(1)
+    try:
+        concurrency_levels = [int(value) for value in args.parameters.get('concurrency', '1,4,16').split(',')]
+        requests = int(args.parameters['requests']) if 'requests' in args.parameters else None
+        mix = parse_mix(args.parameters.get('mix', 'path:1,base64:1,url:1'))
+        warmup = int(args.parameters.get('warmup', 2))
+        startup_timeout = float(args.parameters.get('startup-timeout', 300))
+    except ValueError as e:
+        print(e)
+        manual()
+        sys.exit(1)
+    image_dir = resolve_path(args.arguments[0] if args.arguments else 'example')
+
+    server = args.parameters.get('server', '').rstrip('/')
+    app_process = None
+    if not server:
+        port = _free_port()
+        server = f"http://127.0.0.1:{port}"
+        app_process = start_app(port, 'cache' in args.options)
+    try:
+        wait_ready(server, app_process, startup_timeout)
+        report = run_benchmark(server, image_dir, concurrency_levels, requests, mix, warmup)
+    finally:
+        if app_process is not None:
+            stop_app(app_process)
+    report['server'] = server if app_process is None else 'start.py'
+    if 'output' in args.parameters:
+        with open(resolve_path(args.parameters['output']), 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
@@ -0,0 +1,208 @@
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+from removebg import parse_command, resolve_path
+from removebg.func import list_images, measure_in_subprocess
+
+# 与模型分辨率无关的阶段只在第一个用例上运行
+MODEL_STAGES = ('forward',)
+STAGES = ('decode', 'images_to_tensor', 'preprocess_image', 'forward', 'tensor_to_images', 'composite_rgba',
+          'connected_component', 'crop_polygon_area', 'sunshine', 'webp_animation')
+
+
+def manual():
+    print("Usage: python benchmark_stages.py [MEGAPIXELS ...]")
+    print("Time and peak memory of every pipeline stage on synthetic images (default 1 4 12 megapixels) "
+          "and example images, then compare with the baseline")
+    print("Options Supported:")
+    print("\t--images=IMAGE_DIR\t\toptional, real images to benchmark as well, default example, empty = none")
+    print("\t--stages=a,b\t\t\toptional, stages to run, default all: " + ','.join(STAGES))
+    print("\t--repeat=N\t\t\toptional, runs per stage and image, the fastest is reported, default 3")
+    print("\t--baseline=PATH\t\t\toptional, baseline report, default stage_baseline.json")
+    print("\t--tolerance=RATIO\t\toptional, allowed slowdown / memory growth over the baseline, default 0.2")
+    print("\t--output=REPORT_PATH\t\toptional, save the report as json")
+    print("\t-update-baseline\t\toptional, save this run as the new baseline instead of comparing")
+
+
+def synthetic_image(megapixels: float) -> np.ndarray:
+    """
+    固定的合成商品图：渐变背景上的主体和两个小物体，带纹理以免编码和解码过于简单
+    """
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    rng = np.random.default_rng(0)
+    background = np.linspace(180, 240, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[...] = background
+    cv2.ellipse(image, (width // 2, height // 2), (width // 4, height // 3), 0, 0, 360, (40, 90, 160), -1)
+    cv2.circle(image, (width // 8, height // 8), max(2, width // 40), (30, 30, 30), -1)
+    cv2.rectangle(image, (width * 7 // 8, height * 6 // 8), (width * 15 // 16, height * 7 // 8), (200, 40, 40), -1)
+    noise = rng.integers(-12, 13, (height, width, 1), dtype=np.int16)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def synthetic_mask(height: int, width: int) -> np.ndarray:
+    """
+    与合成图对应的软边遮罩 (H, W, 1)：一个大的主体和两个小连通域
+    """
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.ellipse(mask, (width // 2, height // 2), (width // 4, height // 3), 0, 0, 360, 255, -1)
+    cv2.circle(mask, (width // 8, height // 8), max(2, width // 40), 255, -1)
+    cv2.rectangle(mask, (width * 7 // 8, height * 6 // 8), (width * 15 // 16, height * 7 // 8), 255, -1)
+    return cv2.GaussianBlur(mask, (5, 5), 0)[:, :, np.newaxis]
+
+
+def _build_stage(stage: str, path: str):
+    # 在子进程中准备输入，准备过程不计入耗时和内存，返回 (待测函数, 输入尺寸)
+    import torch
+    from PIL import Image
+    from removebg.backend import MODEL_INPUT_SIZE, get_backend
+    from removebg.bgmask import ComponentFilter, _images_to_tensor, _tensor_to_images
+    from removebg.composite import composite_rgba
+    from removebg.sunshine import sunshine
+    from removebg.utils import crop_image_polygon_area, read_image_to_mat
+    from removebg.webp import create_webp_animation_from_cv2
+    from removebg.worker import _preprocess_image
+
+    image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    height, width = image.shape[:2]
+    mask = synthetic_mask(height, width)
+    size = f"{width}x{height}"
+    if stage == 'decode':
+        return lambda: read_image_to_mat(path, None), size
+    if stage == 'images_to_tensor':
+        return lambda: _images_to_tensor([image], MODEL_INPUT_SIZE), size
+    if stage == 'preprocess_image':
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return lambda: _preprocess_image(rgb, MODEL_INPUT_SIZE), size
+    if stage == 'forward':
+        backend = get_backend()
+        input_tensor = torch.rand(1, 3, *MODEL_INPUT_SIZE)
+        return lambda: backend.predict(input_tensor, [tuple(MODEL_INPUT_SIZE)]), \
+            f"{MODEL_INPUT_SIZE[1]}x{MODEL_INPUT_SIZE[0]}"
+    if stage == 'tensor_to_images':
+        model_mask = cv2.resize(mask, (MODEL_INPUT_SIZE[1], MODEL_INPUT_SIZE[0]), interpolation=cv2.INTER_AREA)
+        mask_tensor = torch.from_numpy(model_mask.astype(np.float32) / 255.0)[np.newaxis, np.newaxis]
+        return lambda: _tensor_to_images([mask_tensor], [(height, width)]), size
+    if stage == 'composite_rgba':
+        pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        alpha = mask[:, :, 0]
+        return lambda: composite_rgba(pil_image, alpha), size
+    if stage == 'connected_component':
+        # 在模型分辨率上选择连通域并放大到原图尺寸
+        component_filter = ComponentFilter('largest')
+        model_mask = cv2.resize(mask, (MODEL_INPUT_SIZE[1], MODEL_INPUT_SIZE[0]), interpolation=cv2.INTER_AREA)
+        return lambda: component_filter.apply(model_mask, (height, width)), size
+    if stage == 'crop_polygon_area':
+        polygon = [(width * 0.2, height * 0.1), (width * 0.8, height * 0.1), (width * 0.8, height * 0.9),
+                   (width * 0.2, height * 0.9)]
+        return lambda: crop_image_polygon_area(image, polygon, (width, height)), size
+    if stage == 'sunshine':
+        return lambda: sunshine(image, mask, True), size
+    if stage == 'webp_animation':
+        frames = sunshine(image, mask, True)
+        return lambda: create_webp_animation_from_cv2(frames), size
+    raise ValueError(f"unknown stage: {stage}")
+
+
+def prepare_cases(megapixels_list: list[float], image_dir: str, work_dir: str) -> list[tuple[str, str]]:
+    """
+    :return: [(用例名称, 图片路径)]，合成图片以 JPEG 保存在 work_dir 中
+    """
+    cases = []
+    for megapixels in megapixels_list:
+        path = os.path.join(work_dir, f"synthetic-{megapixels:g}mp.jpg")
+        cv2.imwrite(path, synthetic_image(megapixels), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        cases.append((f"synthetic-{megapixels:g}MP", path))
+    if image_dir:
+        for path in list_images(image_dir):
+            cases.append((os.path.basename(path), path))
+    return cases
+
+
+def run_benchmark(cases: list[tuple[str, str]], stages: list[str], repeat: int = 3) -> list[dict]:
+    rows = []
+    for stage in stages:
+        for i, (name, path) in enumerate(cases):
+            if stage in MODEL_STAGES and i > 0:
+                break
+            try:
+                result = measure_in_subprocess(_build_stage, (stage, path), repeat)
+            except RuntimeError as e:
+                raise RuntimeError(f"{stage} on {name} failed: {e}")
+            row = {'stage': stage, 'image': 'model' if stage in MODEL_STAGES else name, **result}
+            rows.append(row)
+            print(f"{stage:<20}\t{row['image']:<24}\t{row['ms']:>10.2f}ms\tpeak +{row['peakMb']:.0f}MB", flush=True)
+    return rows
+
+
+def compare_baseline(rows: list[dict], baseline_rows: list[dict], tolerance: float) -> list[str]:
+    """
+    与基准对比，耗时或峰值内存超出 tolerance 比例的阶段视为退化
+    :return: 退化描述列表，空列表表示通过
+    """
+    baseline = {(row['stage'], row['image']): row for row in baseline_rows}
+    regressions = []
+    for row in rows:
+        base = baseline.get((row['stage'], row['image']))
+        if base is None:
+            continue
+        if row['ms'] > base['ms'] * (1 + tolerance):
+            regressions.append(f"{row['stage']} on {row['image']}: {row['ms']:.2f}ms > baseline {base['ms']:.2f}ms")
+        # 内存采样有几 MB 的抖动，小于 8MB 的增长不计
+        if row['peakMb'] > base['peakMb'] * (1 + tolerance) + 8:
+            regressions.append(f"{row['stage']} on {row['image']}: peak +{row['peakMb']:.0f}MB "
+                               f"> baseline +{base['peakMb']:.0f}MB")
+    return regressions
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    args = parse_command()
+    if 'help' in args.options:
+        manual()
+        sys.exit(0)
+    try:
+        megapixels_list = [float(arg) for arg in args.arguments] or [1, 4, 12]
+        repeat = int(args.parameters.get('repeat', 3))
+        tolerance = float(args.parameters.get('tolerance', 0.2))
+        stages = [stage for stage in args.parameters.get('stages', ','.join(STAGES)).split(',') if stage]
+        if any(stage not in STAGES for stage in stages):
+            raise ValueError(f"stages must be in {','.join(STAGES)}")
+    except ValueError as e:
+        print(e)
+        manual()
+        sys.exit(1)
+    image_dir = args.parameters.get('images', 'example')
+    baseline_path = resolve_path(args.parameters.get('baseline', 'stage_baseline.json'))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        cases = prepare_cases(megapixels_list, resolve_path(image_dir) if image_dir else '', work_dir)
+        rows = run_benchmark(cases, stages, repeat)
+    report = {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'stages': rows}
+    if 'output' in args.parameters:
+        with open(resolve_path(args.parameters['output']), 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+    if 'update-baseline' in args.options:
+        with open(baseline_path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"Baseline saved: {baseline_path}")
+    elif os.path.isfile(baseline_path):
+        with open(baseline_path, 'r', encoding='utf-8') as file:
+            regressions = compare_baseline(rows, json.load(file)['stages'], tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions over {baseline_path}:")
+            for regression in regressions:
+                print(f"\t{regression}")
+            sys.exit(1)
+        print(f"No regression over {baseline_path}")
+    else:
+        print(f"Baseline {baseline_path} not found, run with -update-baseline to create it")
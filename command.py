@@ -1,14 +1,52 @@
 import base64
+import os
 import sys
-from removebg import get_executable_directory, RemoveBgDTO, parse_command, is_http_url, resolve_path, process
+import time
+from removebg import get_executable_directory, RemoveBgDTO, parse_command, is_http_url, is_glob, resolve_path, \
+    process, get_env_int
+from removebg.profiling import profile_request, start_profile
 
 
 def manual():
     print("Version: 0.2.3")
     print("Usage: removebg SRC_IMAGE_PATH TARGET_IMAGE_PATH")
     print("or:    removebg SRC_IMAGE_URL TARGET_IMAGE_PATH")
+    print("or:    removebg SRC_DIR|GLOB|LIST_FILE TARGET_DIR -bulk")
     print("Options Supported:")
     print("\t--rect=rectangle\t\t\toptional, selected rectangle: x,y,width,height")
+    print("\t--format=png|webp|webp-lossy\t\toptional, output codec, default by TARGET_IMAGE_PATH extension")
+    print("\t--quality=quality\t\t\toptional, webp quality 0-100, default 80")
+    print("\t-profile\t\t\t\toptional, print stage timings; with PROFILE_DIR set also save cProfile/torch traces")
+    print("\t-bulk\t\t\t\toptional, bulk mode: a directory, a glob or a file listing one path/url per line;")
+    print("\t\t\t\t\texisting outputs in TARGET_DIR are skipped, so an interrupted run can resume")
+    print("\t--workers=N\t\t\t\toptional, bulk mode threads, default BATCH_MAX_SIZE")
+
+
+def run_bulk_command(args):
+    from removebg.bulk import collect_sources, run_bulk
+
+    source = args.arguments[0]
+    if not is_glob(source):
+        source = resolve_path(source)
+    target_dir = resolve_path(args.arguments[1])
+    template = RemoveBgDTO(outputFormat=args.parameters.get('format', 'png'),
+                           quality=int(args.parameters.get('quality', 80)))
+    code, msg = template.check_output()
+    if code != 0:
+        sys.stderr.write(f"Error: code={code}, msg={msg}")
+        sys.exit(1)
+    # 每张图片只处理一次，内存结果缓存没有意义
+    os.environ.setdefault('RESULT_CACHE_MEMORY_MB', '0')
+
+    sources = collect_sources(source)
+    print(f"Found {len(sources)} images, output to {target_dir}")
+    start = time.monotonic()
+    workers = int(args.parameters.get('workers', get_env_int('BATCH_MAX_SIZE', 8)))
+    progress = run_bulk(sources, target_dir, template, workers)
+    print(f"Done: {progress.done - progress.skipped - progress.failed} processed, {progress.skipped} skipped, "
+          f"{progress.failed} failed in {time.monotonic() - start:.1f}s")
+    if progress.failed:
+        sys.exit(2)
 
 
 if __name__ == "__main__":
@@ -17,6 +55,9 @@ if __name__ == "__main__":
     if len(args.arguments) != 2:
         manual()
         sys.exit(1)
+    if 'bulk' in args.options or os.path.isdir(args.arguments[0]) or is_glob(args.arguments[0]):
+        run_bulk_command(args)
+        sys.exit(0)
     dto = RemoveBgDTO()
     dto.responseFormat = 1
     if is_http_url(args.arguments[0]):
@@ -37,7 +78,16 @@ if __name__ == "__main__":
                 if w > 0 and h > 0 and x >= 0 and y >= 0:
                     dto.selectPolygon = [(x, y), (x + w, y), (x + w, y + h), (x, y + h)]
 
-    code, msg, result = process(dto)
+    dto.outputFormat = args.parameters.get('format') or ('webp' if target_path.lower().endswith('.webp') else 'png')
+    if 'quality' in args.parameters:
+        dto.quality = int(args.parameters['quality'])
+
+    with profile_request(start_profile('profile' in args.options)) as profile:
+        code, msg, result = process(dto)
+    if profile is not None:
+        print(f"Timings(ms): {profile.timings()}")
+        for trace_file in profile.trace_files:
+            print(f"Trace: {trace_file}")
     if code != 0:
         sys.stderr.write(f"Error: code={code}, msg={msg}")
         sys.exit(2)
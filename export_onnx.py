@@ -0,0 +1,23 @@
+import sys
+
+from removebg import parse_command, resolve_path
+from removebg.backend import OnnxBackend, TorchBackend, compare_backends, export_onnx
+
+
+def manual():
+    print("Usage: python export_onnx.py [ONNX_PATH]")
+    print("Export model/briaai/RMBG-1.4/model.safetensors to ONNX, default ONNX_PATH: model/briaai/RMBG-1.4/model.onnx")
+    print("Options Supported:")
+    print("\t-verify\t\t\toptional, compare the onnxruntime masks with pytorch after export")
+
+
+if __name__ == "__main__":
+    args = parse_command()
+    if len(args.arguments) > 1:
+        manual()
+        sys.exit(1)
+    onnx_path = export_onnx(resolve_path(args.arguments[0]) if args.arguments else '')
+    print(f"Output: {onnx_path}")
+    if 'verify' in args.options:
+        max_diff = compare_backends(TorchBackend(), OnnxBackend(onnx_path))
+        print(f"max abs mask diff (onnxruntime vs pytorch): {max_diff:.6f}")
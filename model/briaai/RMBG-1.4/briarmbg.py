@@ -388,7 +388,7 @@ class BriaRMBG(PreTrainedModel):
 
         # self.outconv = nn.Conv2d(6*out_ch,out_ch,1)
 
-    def forward(self,x):
+    def _features(self,x):
 
         hx = x
 
@@ -434,6 +434,11 @@ class BriaRMBG(PreTrainedModel):
 
         hx1d = self.stage1d(torch.cat((hx2dup,hx1),1))
 
+        return hx1d,hx2d,hx3d,hx4d,hx5d,hx6
+
+    def forward(self,x):
+
+        hx1d,hx2d,hx3d,hx4d,hx5d,hx6 = self._features(x)
 
         #side output
         d1 = self.side1(hx1d)
@@ -456,3 +461,27 @@ class BriaRMBG(PreTrainedModel):
 
         return [F.sigmoid(d1), F.sigmoid(d2), F.sigmoid(d3), F.sigmoid(d4), F.sigmoid(d5), F.sigmoid(d6)],[hx1d,hx2d,hx3d,hx4d,hx5d,hx6]
 
+    def forward_logits(self,x):
+        """d1 logits at feature resolution (half of the input size), without the other side heads.
+
+        Used by forward_mask and as the graph exported to ONNX.
+        """
+        return self.side1(self._features(x)[0])
+
+    @torch.inference_mode()
+    def forward_mask(self,x,sizes=None):
+        """inference only: compute the d1 side output alone, without autograd.
+
+        The logits of side1 are resized once, straight to each target size,
+        instead of going through 1024x1024 first.
+
+        :param x: input batch, (B, 3, H, W)
+        :param sizes: target (height, width) per image, defaults to the input size
+        :return: list of B mask tensors, each (1, out_ch, height, width) in [0, 1]
+        """
+        d1 = self.forward_logits(x)
+
+        if sizes is None:
+            sizes = [tuple(x.shape[2:])] * x.shape[0]
+
+        return [F.sigmoid(F.interpolate(d1[i:i+1],size=tuple(sizes[i]),mode='bilinear')) for i in range(d1.shape[0])]
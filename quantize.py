@@ -0,0 +1,38 @@
+import json
+import sys
+
+from removebg import parse_command, resolve_path
+from removebg.backend import OnnxBackend, TorchBackend, get_quantized_onnx_path
+from removebg.quantize import compare_masks, quantize_onnx
+
+
+def manual():
+    print("Usage: python quantize.py [CALIBRATION_IMAGE_DIR]")
+    print("Create the INT8 model model/briaai/RMBG-1.4/model_int8.onnx, serve it with INFERENCE_BACKEND=onnx-int8")
+    print("Options Supported:")
+    print("\t--method=static|dynamic\t\toptional, default static, static needs CALIBRATION_IMAGE_DIR")
+    print("\t--compare=IMAGE_DIR\t\toptional, report mask IoU / alpha error of int8 against fp32 on the images")
+    print("\t--output=REPORT_PATH\t\toptional, save the comparison report as json")
+    print("\t-skip\t\t\t\toptional, skip quantization and only compare the existing int8 model")
+
+
+if __name__ == "__main__":
+    args = parse_command()
+    method = args.parameters.get('method', 'static')
+    compare_dir = args.parameters.get('compare', '')
+    if 'skip' not in args.options:
+        if method == 'static' and len(args.arguments) != 1:
+            manual()
+            sys.exit(1)
+        calibration_dir = resolve_path(args.arguments[0]) if args.arguments else ''
+        print(f"Output: {quantize_onnx(method, calibration_dir)}")
+
+    if compare_dir:
+        report = compare_masks(TorchBackend(), OnnxBackend(get_quantized_onnx_path()), resolve_path(compare_dir))
+        for row in report['images']:
+            print(f"{row['image']}\tIoU={row['iou']:.4f}\talphaMAE={row['alphaMae']:.4f}"
+                  f"\tfp32={row['referenceMs']:.0f}ms\tint8={row['candidateMs']:.0f}ms")
+        print(f"mean: {json.dumps(report['mean'])}")
+        if 'output' in args.parameters:
+            with open(resolve_path(args.parameters['output']), 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
@@ -1,7 +1,19 @@
 from .dto import RemoveBgDTO
 from .logger import LogLevel, get_logger
-from .worker import process
-from .func import get_executable_directory, parse_command, CommandArgs, is_http_url, resolve_path
+from .worker import process, remove_background, encode_result, prepare_sunshine, render_sunshine, \
+    sunshine_animation
+from .func import get_executable_directory, parse_command, CommandArgs, is_http_url, is_glob, resolve_path, \
+    get_env_int
+from .executor import BoundedExecutor, QueueFullError, get_executor
+from .engine import EngineClient, get_engine_client, start_engines, stop_engines
+from .cache import CacheEntry, ResultCache, MaskCache, get_result_cache, get_mask_cache
+from .fetcher import FetchError, ImageFetcher, get_fetcher
+from .encoder import OUTPUT_FORMATS, encode_image, media_type, get_encoder_pool, get_encode_executor
 
-__all__ = ['RemoveBgDTO', 'LogLevel', 'get_logger', 'process', 'get_executable_directory', 'parse_command',
-           'CommandArgs', 'is_http_url', 'resolve_path']
+__all__ = ['RemoveBgDTO', 'LogLevel', 'get_logger', 'process', 'remove_background', 'encode_result',
+           'prepare_sunshine', 'render_sunshine', 'sunshine_animation', 'get_executable_directory', 'parse_command',
+           'CommandArgs', 'is_http_url', 'is_glob', 'resolve_path', 'get_env_int', 'BoundedExecutor', 'QueueFullError',
+           'get_executor', 'EngineClient', 'get_engine_client', 'start_engines', 'stop_engines',
+           'CacheEntry', 'ResultCache', 'MaskCache', 'get_result_cache', 'get_mask_cache',
+           'FetchError', 'ImageFetcher', 'get_fetcher',
+           'OUTPUT_FORMATS', 'encode_image', 'media_type', 'get_encoder_pool', 'get_encode_executor']
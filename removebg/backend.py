@@ -0,0 +1,163 @@
+import os
+import threading
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from transformers import AutoModelForImageSegmentation
+
+from .func import get_executable_directory
+from .logger import get_logger
+
+MODEL_INPUT_SIZE = [1024, 1024]
+
+
+def get_model_dir() -> str:
+    return os.path.join(get_executable_directory(), 'model', 'briaai', 'RMBG-1.4')
+
+
+def get_onnx_path() -> str:
+    """
+    ONNX 模型路径，可通过环境变量 ONNX_MODEL_PATH 指定，默认与 safetensors 放在同一目录
+    """
+    return os.environ.get('ONNX_MODEL_PATH') or os.path.join(get_model_dir(), 'model.onnx')
+
+
+def get_quantized_onnx_path() -> str:
+    """
+    INT8 量化 ONNX 模型路径，可通过环境变量 ONNX_INT8_MODEL_PATH 指定
+    """
+    return os.environ.get('ONNX_INT8_MODEL_PATH') or os.path.join(get_model_dir(), 'model_int8.onnx')
+
+
+def load_model(device: torch.device | str = "cpu") -> AutoModelForImageSegmentation:
+    """加载 PyTorch 模型
+    :param device: 模型所在设备
+    :return: 加载的模型
+    """
+    model = AutoModelForImageSegmentation.from_pretrained(get_model_dir(), trust_remote_code=True)
+    model.to(device)
+    model.eval()
+    return model
+
+
+def _logits_to_masks(logits: torch.Tensor, sizes: list[tuple[int, int]]) -> list[torch.Tensor]:
+    # 与 BriaRMBG.forward_mask 相同：logits 直接缩放到原图尺寸后再 sigmoid
+    return [torch.sigmoid(F.interpolate(logits[i:i + 1], size=tuple(sizes[i]), mode='bilinear'))
+            for i in range(logits.shape[0])]
+
+
+class TorchBackend:
+    """
+    PyTorch eager 推理后端
+    """
+    name = 'torch'
+
+    def __init__(self):
+        self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        self.model = load_model(self.device)
+
+    def predict(self, input_tensor: torch.Tensor, sizes: list[tuple[int, int]]) -> list[torch.Tensor]:
+        """
+        :param input_tensor: 预处理后的输入批次 (batch_size, 3, 1024, 1024)
+        :param sizes: 每张图片的目标尺寸 [(height, width), ...]
+        :return: 每张图片的遮罩张量 (1, 1, height, width)，取值 [0, 1]
+        """
+        return self.model.forward_mask(input_tensor.to(self.device), sizes)
+
+
+class OnnxBackend:
+    """
+    onnxruntime CPU 推理后端，模型由 export_onnx 导出，支持动态批次
+    """
+    name = 'onnx'
+
+    def __init__(self, onnx_path: str = ''):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError(f"INFERENCE_BACKEND={self.name} requires the onnxruntime package") from e
+        onnx_path = onnx_path or get_onnx_path()
+        if not os.path.isfile(onnx_path):
+            raise RuntimeError(f"onnx model {onnx_path} not exist, run export_onnx.py / quantize.py first")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # 线程数与 torch 保持一致，共享推理进程中已按 INFERENCE_THREADS 设置
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, input_tensor: torch.Tensor, sizes: list[tuple[int, int]]) -> list[torch.Tensor]:
+        logits = self.session.run(None, {self.input_name: input_tensor.numpy()})[0]
+        return _logits_to_masks(torch.from_numpy(logits), sizes)
+
+
+def load_backend() -> TorchBackend | OnnxBackend:
+    """
+    按环境变量 INFERENCE_BACKEND 加载推理后端：torch（默认）、onnx 或 onnx-int8
+    """
+    backend = os.environ.get('INFERENCE_BACKEND', 'torch').strip().lower()
+    get_logger('removebg').info(f"loading {backend} inference backend")
+    if backend == 'onnx':
+        return OnnxBackend()
+    if backend == 'onnx-int8':
+        return OnnxBackend(get_quantized_onnx_path())
+    return TorchBackend()
+
+
+_backend: TorchBackend | OnnxBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> TorchBackend | OnnxBackend:
+    """
+    进程内共享的推理后端，首次使用时加载
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = load_backend()
+    return _backend
+
+
+class _LogitsGraph(torch.nn.Module):
+    # torch.onnx.export 只导出 forward，这里把 forward 换成只输出 d1 logits 的推理分支
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model.forward_logits(x)
+
+
+def export_onnx(onnx_path: str = '', opset_version: int = 17) -> str:
+    """
+    将 model.safetensors 导出为 ONNX 模型，输入 (batch, 3, 1024, 1024)，输出 d1 logits (batch, 1, 512, 512)，
+    批次维度为动态
+    :param onnx_path: 输出路径，默认 get_onnx_path()
+    :param opset_version: ONNX opset 版本
+    :return: 输出路径
+    """
+    onnx_path = onnx_path or get_onnx_path()
+    graph = _LogitsGraph(load_model()).eval()
+    dummy_input = torch.zeros(1, 3, *MODEL_INPUT_SIZE, dtype=torch.float32)
+    with torch.inference_mode():
+        torch.onnx.export(graph, (dummy_input,), onnx_path,
+                          input_names=['input'], output_names=['logits'],
+                          dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+                          opset_version=opset_version, do_constant_folding=True, dynamo=False)
+    return onnx_path
+
+
+def compare_backends(reference, candidate, batch_size: int = 2) -> float:
+    """
+    在随机输入上比较两个后端的遮罩，返回最大绝对误差
+    """
+    input_tensor = torch.rand(batch_size, 3, *MODEL_INPUT_SIZE, dtype=torch.float32) - 0.5
+    sizes = [tuple(MODEL_INPUT_SIZE)] * batch_size
+    reference_masks = reference.predict(input_tensor, sizes)
+    candidate_masks = candidate.predict(input_tensor, sizes)
+    return max(float(np.abs(r.cpu().numpy() - c.cpu().numpy()).max()) for r, c in zip(reference_masks, candidate_masks))
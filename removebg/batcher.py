@@ -0,0 +1,102 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from .logger import get_logger
+
+
+class MicroBatcher:
+    """
+    动态微批调度器
+
+    收集一个时间窗口内到达的并发请求，合并为一个批次交给批处理函数（模型推理）执行，
+    再把每个结果分发回各自等待的请求。
+    窗口由两个参数决定：批次达到 max_batch_size，或第一个请求已等待 max_wait_ms 毫秒。
+    """
+
+    def __init__(self, batch_func: Callable[[list[Any]], list[Any]], max_batch_size: int = 8,
+                 max_wait_ms: float = 10, name: str = 'micro-batcher'):
+        """
+        :param batch_func: 批处理函数，输入列表，返回等长的结果列表
+        :param max_batch_size: 单批次最大请求数
+        :param max_wait_ms: 凑批的最大等待时间（毫秒）
+        :param name: 后台线程名称
+        """
+        self.batch_func = batch_func
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: queue.Queue[tuple[Any, Future] | None] = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """
+        提交一个请求，返回对应结果的 Future
+        """
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def run(self, item: Any) -> Any:
+        """
+        提交一个请求并阻塞等待其结果
+        """
+        return self.submit(item).result()
+
+    def shutdown(self):
+        """
+        停止后台线程，已入队的请求处理完后退出
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self) -> tuple[list[tuple[Any, Future]], bool]:
+        """
+        阻塞等待第一个请求，然后在时间窗口内尽量凑满一个批次
+        :return: 批次，以及是否收到了停止信号
+        """
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _loop(self):
+        stopped = False
+        while not stopped:
+            batch, stopped = self._collect()
+            # 跳过已被调用方取消的请求
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+            del batch
+            if items:
+                self._run_batch(items, futures)
+
+    def _run_batch(self, items: list[Any], futures: list[Future]):
+        try:
+            results = self.batch_func(items)
+            if len(results) != len(items):
+                raise RuntimeError(f"batch_func returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            get_logger('removebg').exception(msg="micro batch failed", exc_info=e)
+            items.clear()
+            for future in futures:
+                future.set_exception(e)
+            return
+        # 先释放对输入的引用再通知调用方，调用方可以立即回收输入（例如共享内存）
+        items.clear()
+        for future, result in zip(futures, results):
+            future.set_result(result)
@@ -1,23 +1,20 @@
 
+import math
 import os
 import time
 import cv2
 import numpy as np
-import torch.nn.functional as F
 import torch
-from .func import get_executable_directory
-from transformers import AutoModelForImageSegmentation
+from .backend import MODEL_INPUT_SIZE, get_backend
+from .cache import content_key, get_mask_cache
+from .composite import mask_to_uint8, resize_mask
+from .func import get_env_int, get_env_float
 
-def _load_model() -> AutoModelForImageSegmentation:
-    """加载模型
-    :return: 加载的模型
-    """
-    root_dir = get_executable_directory()
-    model_dir = os.path.join(root_dir, 'model', 'briaai', 'RMBG-1.4')
-    model = AutoModelForImageSegmentation.from_pretrained(model_dir, trust_remote_code=True)
-    model.to("cpu")
-    model.eval()
-    return model
+# 全局遮罩上前景/背景边界附近的不确定带宽度（模型分辨率像素），分块结果只在不确定带内生效
+_PRIOR_BAND_RADIUS = 8
+# 连通域按该阈值二值化；丢弃的连通域向外扩展的范围覆盖阈值以下的软边（模型分辨率像素）
+_COMPONENT_THRESHOLD = 128
+_COMPONENT_EDGE_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
 
 def _images_to_tensor(input_images: list[np.ndarray], model_input_size: list) -> tuple[torch.Tensor, list[tuple]]:
     """
@@ -42,11 +39,13 @@ def _images_to_tensor(input_images: list[np.ndarray], model_input_size: list) ->
         elif input_image.shape[2] == 3:  # 如果是 BGR 格式
             input_image = cv2.cvtColor(input_image, cv2.COLOR_BGR2RGB)
         
-        # (height, width, channels) => (channels, height, width)
-        input_tensor = torch.tensor(input_image, dtype=torch.float32).permute(2, 0, 1)
-        
-        # 调整尺寸到模型输入大小
-        input_tensor = F.interpolate(torch.unsqueeze(input_tensor, 0), size=model_input_size, mode='bilinear')
+        # 先在 uint8 上调整尺寸到模型输入大小，再转换为 float32，避免生成原图尺寸的浮点张量
+        if input_image.shape[:2] != tuple(model_input_size):
+            input_image = cv2.resize(input_image, (model_input_size[1], model_input_size[0]),
+                                     interpolation=cv2.INTER_LINEAR)
+
+        # (height, width, channels) => (1, channels, height, width)
+        input_tensor = torch.from_numpy(np.ascontiguousarray(input_image)).permute(2, 0, 1).unsqueeze(0).float()
         
         # 归一化到 [0, 1]
         input_tensor = torch.divide(input_tensor, 255.0)
@@ -57,88 +56,267 @@ def _images_to_tensor(input_images: list[np.ndarray], model_input_size: list) ->
     batch_tensor = torch.cat(tensors, dim=0)
     return batch_tensor, original_sizes
 
-def _tensor_to_images(output_tensor: torch.Tensor, original_sizes: list[tuple]) -> list[cv2.Mat]:
+def _tensor_to_images(output_tensors: list[torch.Tensor], image_sizes: list[tuple],
+                      component_filter: 'ComponentFilter | None' = None) -> list[cv2.Mat]:
     """
     将模型推理的输出张量解析为多张图片。
 
-    :param output_tensor: 模型推理后的输出张量，形状为 (batch_size, channels, height, width)。
-    :param original_sizes: 每张图片的原始尺寸列表 [(height1, width1), (height2, width2), ...]。
-    :return: 解析后的图片列表，每张图片为 NumPy 数组。
+    :param output_tensors: 模型推理后的输出张量列表，每个形状为 (1, channels, height, width)，模型分辨率。
+    :param image_sizes: 每张图片的原始大小 (height, width)
+    :param component_filter: 连通域过滤，在放大到原图尺寸之前应用，None 表示不过滤
+    :return: 解析后的图片列表，每张图片为 NumPy 数组 (height, width, 1)。
     """
     images = []
-    batch_size = output_tensor.shape[0]
-
-    for i in range(batch_size):
-        # 提取当前图片的张量
-        single_tensor = output_tensor[i]  # 形状为 (channels, height, width)
-        
-        # 获取对应的原始尺寸
-        original_size = original_sizes[i]
+    for output_tensor, image_size in zip(output_tensors, image_sizes):
+        # 在模型分辨率上归一化并转换为 uint8，再放大到原图尺寸，不产生原图尺寸的浮点张量
+        if component_filter is None:
+            image_array = mask_to_uint8(output_tensor, image_size)
+        else:
+            image_array = component_filter.apply(mask_to_uint8(output_tensor), image_size)
 
-        
-        # 调整尺寸到原始大小
-        resized_tensor = F.interpolate(single_tensor.unsqueeze(0), size=original_size, mode='bilinear')
-        
-        # 去掉批次维度并归一化到 [0, 1]
-        resized_tensor = torch.squeeze(resized_tensor, 0)
-        ma = torch.max(resized_tensor)
-        mi = torch.min(resized_tensor)
-        normalized_tensor = (resized_tensor - mi) / (ma - mi)
-        
-        # 转换为 NumPy 数组并调整为 (height, width, channels)
-        image_array = (normalized_tensor * 255).permute(1, 2, 0).cpu().data.numpy().astype(np.uint8)
-        
         # 添加到结果列表
-        images.append(image_array)
-    return images  
+        images.append(image_array[:, :, np.newaxis])
+    return images
 
-def _extract_max_area_connected_component(input_mask: cv2.Mat) -> cv2.Mat:
+class ComponentFilter:
     """
-    将输入的mask中除了最大的目标区域外的其他区域置为0
-    :param input_mask: 输入的mask，形状为 (H, W, 1)
-    :return: 处理后的mask，保留最大连续区域
+    连通域过滤：在模型分辨率的二值化遮罩上选择保留的连通域，被丢弃的连通域在放大遮罩之前清零，
+    原图分辨率上不做连通域标记。保留下来的部分仍是模型输出的软边遮罩
     """
-    # 查找所有连通域
-    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(input_mask, connectivity=8)
 
-    # 如果没有连通域，直接返回全零的mask
-    if num_labels <= 1:
-        return np.zeros_like(input_mask, dtype=np.uint8)
-    
-    if num_labels == 2:
-        # 只有一个连通域（背景和前景），直接返回前景
-        return input_mask
+    POLICIES = ('largest', 'top-k', 'min-area', 'all')
+
+    def __init__(self, policy: str | None = None, top_k: int | None = None, min_area: float | None = None):
+        """
+        :param policy: largest 只保留最大的连通域；top-k 保留面积最大的 top_k 个；
+                       min-area 保留面积不小于最大连通域 min_area 倍的连通域；all 不过滤。默认读取环境变量 COMPONENT_POLICY
+        :param top_k: top-k 策略保留的个数，默认读取环境变量 COMPONENT_TOP_K
+        :param min_area: min-area 策略的面积比例 (0-1]，默认读取环境变量 COMPONENT_MIN_AREA
+        """
+        policy = os.environ.get('COMPONENT_POLICY', 'largest') if policy is None else policy
+        self.policy = policy.strip().lower() or 'largest'
+        if self.policy not in self.POLICIES:
+            raise ValueError(f"component policy: {policy} must be one of {', '.join(self.POLICIES)}")
+        self.top_k = max(1, get_env_int('COMPONENT_TOP_K', 3) if top_k is None else top_k)
+        self.min_area = get_env_float('COMPONENT_MIN_AREA', 0.05) if min_area is None else min_area
+
+    def keep_mask(self, mask: np.ndarray) -> np.ndarray | None:
+        """
+        :param mask: 模型分辨率的遮罩 (height, width)，uint8
+        :return: 保留的连通域（含其软边）为 255、其余为 0 的 uint8 掩码，阈值以下、不与保留的连通域相连的
+                 淡影也被清除；policy 为 all 或遮罩中没有达到阈值的前景时返回 None，不过滤
+        """
+        if self.policy == 'all':
+            return None
+        _, binary = cv2.threshold(mask, _COMPONENT_THRESHOLD - 1, 255, cv2.THRESH_BINARY)
+        num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+        # 没有前景（背景的label为0），无法判断哪些是主体
+        if num_labels <= 1:
+            return None
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        if self.policy == 'min-area':
+            kept = np.flatnonzero(areas >= areas.max() * self.min_area)
+        else:
+            kept = np.argsort(areas)[::-1][:self.top_k if self.policy == 'top-k' else 1]
+
+        keep = np.zeros(num_labels, dtype=np.uint8)
+        keep[kept + 1] = 255
+        # 阈值以下的软边不属于任何连通域，扩展保留区域把紧邻的软边一并保留，其它位置全部清零
+        return cv2.dilate(keep[labels], _COMPONENT_EDGE_KERNEL)
+
+    def apply(self, mask: np.ndarray, size: tuple[int, int] | None = None) -> np.ndarray:
+        """
+        过滤遮罩并放大到 size
+        :param mask: 遮罩 (height, width)，uint8；大于模型分辨率时（分块推理的结果）在缩小的副本上选择连通域
+        :param size: 输出尺寸 (height, width)，默认保持 mask 的尺寸
+        :return: 遮罩 (height, width)，uint8
+        """
+        height, width = mask.shape[:2]
+        if height * width > MODEL_INPUT_SIZE[0] * MODEL_INPUT_SIZE[1]:
+            small = cv2.resize(mask, (MODEL_INPUT_SIZE[1], MODEL_INPUT_SIZE[0]), interpolation=cv2.INTER_AREA)
+            keep = self.keep_mask(small)
+            if keep is not None:
+                keep = cv2.resize(keep, (width, height), interpolation=cv2.INTER_LINEAR)
+                mask = cv2.multiply(mask, keep, scale=1 / 255)
+        else:
+            keep = self.keep_mask(mask)
+            if keep is not None:
+                mask = cv2.bitwise_and(mask, keep)
+        if size is not None and mask.shape[:2] != tuple(size):
+            mask = cv2.resize(mask, (size[1], size[0]), interpolation=cv2.INTER_LINEAR)
+        return mask
+
 
-    # 找到面积最大的连通域（排除背景，背景的label为0）
-    largest_label = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+def _tile_origins(length: int, tile_size: int, overlap: int) -> list[int]:
+    """
+    计算一个方向上各分块的起点，分块均匀分布，最后一块贴齐边缘，相邻分块至少重叠 overlap 像素
+    """
+    if length <= tile_size:
+        return [0]
+    count = math.ceil((length - overlap) / (tile_size - overlap))
+    return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+
+def _resize_region(src: np.ndarray, full_size: tuple[int, int], box: tuple[int, int, int, int]) -> np.ndarray:
+    """
+    把低分辨率的 src 中对应原图 box 区域的部分放大到 box 尺寸。
+    结果与先把 src 放大到原图尺寸再裁剪相同，但只分配 box 大小的内存
+    :param src: 低分辨率图片 (height, width)
+    :param full_size: 原图尺寸 (height, width)
+    :param box: 原图上的区域 (x0, y0, x1, y1)
+    """
+    x0, y0, x1, y1 = box
+    scale_x = src.shape[1] / full_size[1]
+    scale_y = src.shape[0] / full_size[0]
+    # 目标像素 (x, y) 对应 src 中的 ((x + x0 + 0.5) * scale_x - 0.5, (y + y0 + 0.5) * scale_y - 0.5)
+    matrix = np.array([[scale_x, 0, (x0 + 0.5) * scale_x - 0.5],
+                       [0, scale_y, (y0 + 0.5) * scale_y - 0.5]], dtype=np.float64)
+    return cv2.warpAffine(src, matrix, (x1 - x0, y1 - y0), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                          borderMode=cv2.BORDER_REPLICATE)
 
-    # 创建一个新的mask，仅保留最大连通域
-    output_mask = np.zeros_like(input_mask, dtype=np.uint8)
-    output_mask[labels == largest_label] = 255
 
-    return output_mask
+def _uncertainty_band(global_mask: np.ndarray) -> np.ndarray:
+    """
+    全局遮罩的不确定带：前景/背景边界附近为 255，确定的前景和背景为 0
+    :param global_mask: 模型分辨率的全局遮罩 (height, width)，uint8
+    :return: 权重 (height, width)，uint8
+    """
+    uncertainty = (255 - np.abs(global_mask.astype(np.int16) * 2 - 255)).astype(np.uint8)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * _PRIOR_BAND_RADIUS + 1, 2 * _PRIOR_BAND_RADIUS + 1))
+    band = cv2.dilate(uncertainty, kernel)
+    return cv2.GaussianBlur(band, (0, 0), _PRIOR_BAND_RADIUS / 2)
+
 
 class BackGroundMaskSeparator:
     """
     背景遮罩分离器
     """
-    def __init__(self):
-        self.model = _load_model()
+    def __init__(self, tile_size: int | None = None, tile_overlap: int | None = None):
+        """
+        :param tile_size: 分块推理的分块边长（原图像素），长边超过该值的图片按重叠分块推理，0 表示不分块；
+                          默认读取环境变量 TILE_SIZE
+        :param tile_overlap: 相邻分块的最小重叠像素，默认读取环境变量 TILE_OVERLAP
+        """
+        # 推理后端由 INFERENCE_BACKEND 选择，与 worker 共用同一个实例
+        self.backend = get_backend()
+        self.tile_size = get_env_int('TILE_SIZE', 0) if tile_size is None else tile_size
+        self.tile_overlap = get_env_int('TILE_OVERLAP', 256) if tile_overlap is None else tile_overlap
+        self.tile_overlap = max(0, min(self.tile_overlap, self.tile_size // 2))
+        # 连通域过滤策略由 COMPONENT_POLICY / COMPONENT_TOP_K / COMPONENT_MIN_AREA 配置
+        self.component_filter = ComponentFilter()
+
+    def _use_tiles(self, input_image: cv2.Mat) -> bool:
+        return self.tile_size > 0 and max(input_image.shape[0], input_image.shape[1]) > self.tile_size
+
+    def _calc_tiled_mask(self, input_image: cv2.Mat) -> cv2.Mat:
+        """
+        分块推理：整图的低分辨率推理作为全局先验，重叠分块的推理结果只在全局遮罩的不确定带（边缘附近）内
+        替换全局结果，避免分块缺少上下文时误判；重叠区域按线性权重与已写入的结果混合。
+        整图和各分块按 BATCH_MAX_SIZE 合并成批次推理。分块结果使用整图的最小/最大值归一化，
+        与全局先验（mask_to_uint8）的取值范围一致；不按分块各自归一化，否则只有背景的分块会被拉伸。
+        除了输出遮罩本身，内存占用只与分块大小和批次大小有关，与图片大小无关
+        :param input_image: 输入图片
+        :return: 遮罩 (height, width, 1)，uint8
+        """
+        height, width = input_image.shape[:2]
+        xs = _tile_origins(width, self.tile_size, self.tile_overlap)
+        ys = _tile_origins(height, self.tile_size, self.tile_overlap)
+        # (行, 列, 原图上的区域)，第一项为整图
+        tiles = [(row, col, (x0, y0, min(width, x0 + self.tile_size), min(height, y0 + self.tile_size)))
+                 for row, y0 in enumerate(ys) for col, x0 in enumerate(xs)]
+        items = [(-1, -1, None)] + tiles
+        batch_size = max(1, get_env_int('BATCH_MAX_SIZE', 8))
+
+        output = np.zeros((height, width), dtype=np.uint8)
+        global_mask = band = None
+        low = scale = 0.0
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            input_tensor, _ = _images_to_tensor(
+                [input_image if box is None else input_image[box[1]:box[3], box[0]:box[2]] for _, _, box in batch],
+                MODEL_INPUT_SIZE)
+            sizes = [tuple(MODEL_INPUT_SIZE) if box is None else (box[3] - box[1], box[2] - box[0])
+                     for _, _, box in batch]
+            output_tensors = self.backend.predict(input_tensor, sizes)
+            del input_tensor
+            for (row, col, box), tile in zip(batch, output_tensors):
+                if box is None:
+                    # 全局先验，同时记录归一化参数
+                    global_tensor = tile.detach().squeeze().float().cpu()
+                    low = float(global_tensor.min())
+                    scale = 1 / max(float(global_tensor.max()) - low, 1e-6)
+                    global_mask = mask_to_uint8(global_tensor)
+                    band = _uncertainty_band(global_mask)
+                    del global_tensor
+                    continue
+                tile = np.clip((tile.squeeze().float().cpu().numpy() - low) * scale, 0, 1)
+                self._blend_tile(output, tile, box, row, col, xs, ys, global_mask, band)
+            del output_tensors
+        return output[:, :, np.newaxis]
+
+    def _blend_tile(self, output: np.ndarray, tile: np.ndarray, box: tuple[int, int, int, int], row: int, col: int,
+                    xs: list[int], ys: list[int], global_mask: np.ndarray, band: np.ndarray):
+        """
+        把一个分块的结果写入 output：不确定带内使用分块结果，其它位置使用全局先验，与左侧、上方已写入的分块线性过渡
+        :param tile: 归一化后的分块遮罩 (height, width)，取值 [0, 1]
+        """
+        x0, y0, x1, y1 = box
+        full_size = output.shape[:2]
+        # 全局先验 + 不确定带内的分块细节
+        prior = _resize_region(global_mask, full_size, box).astype(np.float32) / 255
+        weight = _resize_region(band, full_size, box).astype(np.float32) / 255
+        tile = prior + weight * (tile - prior)
+        del prior, weight
+
+        # 与左侧、上方已写入的分块在重叠区域线性过渡
+        blend = np.ones(tile.shape, dtype=np.float32)
+        if col > 0:
+            overlap = xs[col - 1] + self.tile_size - x0
+            blend[:, :overlap] *= np.linspace(0, 1, overlap + 2, dtype=np.float32)[1:-1]
+        if row > 0:
+            overlap = ys[row - 1] + self.tile_size - y0
+            blend[:overlap, :] *= np.linspace(0, 1, overlap + 2, dtype=np.float32)[1:-1][:, np.newaxis]
+        region = output[y0:y1, x0:x1]
+        region[...] = np.clip(region * (1 - blend) + tile * blend * 255 + 0.5, 0, 255).astype(np.uint8)
 
     # 将图片的背景去除
     def calc_mask(self, input_images: list[cv2.Mat]) -> list[cv2.Mat]:
         start_time = time.time()
-        input_tensor, image_size = _images_to_tensor(input_images, [1024, 1024])
-        # 进行推理
-        results = self.model(input_tensor)
-        output_tensor = results[0][0]
-        # 解析输出张量为图片
-        masks = _tensor_to_images(output_tensor, image_size)
-        results = []
-        for mask in masks:
-            results.append(_extract_max_area_connected_component(mask))
+        # 已经推理过的图片（按像素内容哈希）直接使用缓存的整图遮罩
+        mask_cache = get_mask_cache()
+        masks: list[cv2.Mat | None] = [None] * len(input_images)
+        # 大图按分块推理，结果保留原图分辨率的细节，不使用模型分辨率的遮罩缓存
+        for i, input_image in enumerate(input_images):
+            if self._use_tiles(input_image):
+                mask = self._calc_tiled_mask(input_image)
+                masks[i] = self.component_filter.apply(mask[:, :, 0])[:, :, np.newaxis]
+        keys = []
+        if mask_cache is not None:
+            # 缓存的是过滤后的遮罩，过滤策略也是键的一部分
+            component_filter = self.component_filter
+            keys = [content_key(np.ascontiguousarray(input_image), component_filter.policy, component_filter.top_k,
+                                component_filter.min_area) if masks[i] is None else ''
+                    for i, input_image in enumerate(input_images)]
+            for i, input_image in enumerate(input_images):
+                if masks[i] is not None:
+                    continue
+                mask = mask_cache.get(keys[i], input_image.shape[:2])
+                if mask is not None:
+                    masks[i] = mask[:, :, np.newaxis]
+
+        missing = [i for i, mask in enumerate(masks) if mask is None]
+        if missing:
+            input_tensor, image_size = _images_to_tensor([input_images[i] for i in missing], MODEL_INPUT_SIZE)
+            # 进行推理，只计算 d1，输出模型分辨率的遮罩
+            output_tensors = self.backend.predict(input_tensor, [tuple(MODEL_INPUT_SIZE)] * len(missing))
+            # 连通域在放大之前按模型分辨率过滤；缓存放大之前的遮罩，命中与未命中都从它放大一次
+            for i, output_tensor, size in zip(missing, output_tensors, image_size):
+                model_mask = self.component_filter.apply(mask_to_uint8(output_tensor))
+                if mask_cache is not None:
+                    mask_cache.put(keys[i], model_mask)
+                masks[i] = resize_mask(model_mask, size)[:, :, np.newaxis]
         end_time = time.time()
         print(f"calc_mask time: {end_time - start_time:.2f} seconds")
-        return results
+        return masks
     
     
\ No newline at end of file
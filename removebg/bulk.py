@@ -0,0 +1,187 @@
+import glob
+import hashlib
+import os
+import re
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from .dto import RemoveBgDTO
+from .func import IMAGE_EXTENSIONS, is_glob, is_http_url
+from .worker import process
+
+def _glob_root(pattern: str) -> str:
+    # 第一个通配符之前的目录，输出文件保持相对该目录的子目录结构
+    return os.path.dirname(pattern[:re.search(r'[*?\[]', pattern).start()]) or '.'
+
+
+def _url_name(url: str) -> str:
+    # URL 的文件名可能重复（例如不同目录下的 image.jpg），附加 URL 的哈希保证唯一且重新运行时不变
+    stem = os.path.splitext(urllib.parse.urlsplit(url).path.rstrip('/').split('/')[-1])[0]
+    stem = re.sub(r'[^\w.-]', '_', urllib.parse.unquote(stem))
+    digest = hashlib.sha256(url.encode('utf-8')).hexdigest()[:12]
+    return f"{stem}-{digest}" if stem else digest
+
+
+def _relative_names(paths: list[str]) -> list[str]:
+    # 本地路径相对所在目录的公共父目录，保持子目录结构
+    directories = [os.path.dirname(os.path.abspath(path)) for path in paths]
+    try:
+        root = os.path.commonpath(directories) if directories else ''
+    except ValueError:
+        # Windows 下位于不同盘符，没有公共父目录
+        return [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    return [os.path.splitext(os.path.relpath(os.path.abspath(path), root))[0] for path in paths]
+
+
+def _unique_names(items: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """
+    输出文件名重复时（例如 a.jpg 与 a.png）按输入顺序为后出现的输入添加 -1、-2 等后缀，
+    不区分大小写比较，避免在大小写不敏感的文件系统上互相覆盖；输入顺序固定，重新运行时的文件名不变
+    """
+    seen = set()
+    result = []
+    for source, name in items:
+        unique_name = name
+        index = 0
+        while unique_name.lower() in seen:
+            index += 1
+            unique_name = f"{name}-{index}"
+        if unique_name != name:
+            print(f"Warning: output name {name} is used by another input, {source} is written to {unique_name}",
+                  flush=True)
+        seen.add(unique_name.lower())
+        result.append((source, unique_name))
+    return result
+
+
+def collect_sources(source: str) -> list[tuple[str, str]]:
+    """
+    收集批量处理的输入
+    :param source: 目录（递归查找图片）、glob 表达式，或每行一个路径/URL 的列表文件
+    :return: [(图片路径或 URL, 输出文件名（不含扩展名，可包含子目录）)]，按输入顺序；
+             目录和 glob 的输出文件名相对目录或 glob 中第一个通配符之前的目录，列表文件中的本地路径相对它们的公共父目录，
+             URL 使用文件名加 URL 的哈希；重复的文件名添加数字后缀
+    """
+    if os.path.isdir(source):
+        items = []
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    items.append((path, os.path.splitext(os.path.relpath(path, source))[0]))
+        return _unique_names(sorted(items))
+    if is_glob(source):
+        root = _glob_root(source)
+        paths = sorted(path for path in glob.glob(source, recursive=True) if os.path.isfile(path))
+        return _unique_names([(path, os.path.splitext(os.path.relpath(path, root))[0]) for path in paths])
+
+    lines = []
+    with open(source, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                lines.append(line)
+    local_paths = [line for line in lines if not is_http_url(line)]
+    local_names = dict(zip(local_paths, _relative_names(local_paths)))
+    return _unique_names([(line, _url_name(line) if is_http_url(line) else local_names[line]) for line in lines])
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class _Progress:
+    """
+    线程安全的进度统计，定期打印吞吐量和预计剩余时间
+    """
+
+    def __init__(self, total: int, interval: float = 2.0):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self._processed = 0
+        self._start = time.monotonic()
+        self._last_print = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, status: str):
+        with self._lock:
+            self.done += 1
+            if status == 'skipped':
+                self.skipped += 1
+            elif status == 'failed':
+                self.failed += 1
+            else:
+                self._processed += 1
+            now = time.monotonic()
+            if now - self._last_print >= self.interval or self.done == self.total:
+                self._last_print = now
+                self._print(now)
+
+    def _print(self, now: float):
+        elapsed = now - self._start
+        # 跳过的文件几乎不耗时，吞吐量只按实际处理的图片计算
+        rate = self._processed / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.done
+        eta = _format_duration(remaining / rate) if rate > 0 else '--:--:--'
+        print(f"[{self.done}/{self.total}] {rate:.2f} img/s, skipped {self.skipped}, failed {self.failed}, "
+              f"elapsed {_format_duration(elapsed)}, ETA {eta}", flush=True)
+
+
+def _process_one(source: str, target_path: str, template: RemoveBgDTO) -> str:
+    if os.path.isfile(target_path) and os.path.getsize(target_path) > 0:
+        return 'skipped'
+    dto = template.model_copy()
+    if is_http_url(source):
+        dto.url = source
+    else:
+        dto.path = os.path.abspath(source)
+    code, msg, result = process(dto)
+    if code != 0:
+        print(f"Error: {source}: code={code}, msg={msg}", flush=True)
+        return 'failed'
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    # 先写临时文件再改名，中断时不会留下被当作已完成的半个文件
+    tmp_path = f"{target_path}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(result)
+    os.replace(tmp_path, target_path)
+    return 'ok'
+
+
+def run_bulk(sources: list[tuple[str, str]], target_dir: str, template: RemoveBgDTO, workers: int = 8) -> _Progress:
+    """
+    批量去除背景。读取、解码、编码和写文件在线程池中并行进行，
+    各线程的推理经由微批调度器合并成批次；已存在的输出文件会被跳过，中断后重新运行即可继续
+    :param sources: collect_sources 的结果
+    :param target_dir: 输出目录
+    :param template: 输出参数模板（outputFormat 等），path/url 由每个输入填充
+    :param workers: 线程数，建议不小于 BATCH_MAX_SIZE，使每个推理批次都能填满
+    :return: 进度统计
+    """
+    template = template.model_copy(update={'responseFormat': 1})
+    extension = 'png' if template.outputFormat == 'png' else 'webp'
+    progress = _Progress(len(sources))
+    # 限制已提交的任务数，输入列表很长时内存占用不随之增长
+    slots = threading.BoundedSemaphore(workers * 2)
+
+    def task(source: str, target_path: str):
+        try:
+            status = _process_one(source, target_path, template)
+        except Exception as e:
+            print(f"Error: {source}: {e}", flush=True)
+            status = 'failed'
+        finally:
+            slots.release()
+        progress.update(status)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk') as pool:
+        for source, name in sources:
+            slots.acquire()
+            pool.submit(task, source, os.path.join(target_dir, f"{name}.{extension}"))
+    return progress
@@ -0,0 +1,327 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from .composite import resize_mask
+from .func import get_env_int
+from .logger import get_logger
+from .metrics import CACHE_LOOKUPS
+
+
+def content_key(data: bytes | memoryview | np.ndarray, *params: Any) -> str:
+    """
+    内容寻址的缓存键：sha256(内容) + 参数
+    :param data: 内容字节，也可以是 C 连续的 numpy 数组（直接哈希像素，不复制，形状和类型也参与哈希）
+    :param params: 影响结果的参数，使用 repr 参与哈希
+    :return: 十六进制键
+    """
+    digest = hashlib.sha256(data)
+    if isinstance(data, np.ndarray):
+        # 字节相同而形状不同的数组（例如转置的图片）是不同的内容
+        digest.update(repr((data.shape, data.dtype.str)).encode('utf-8'))
+    for param in params:
+        digest.update(b'\0')
+        digest.update(repr(param).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class CacheEntry(NamedTuple):
+    """
+    缓存条目：内容字节和附加信息（例如 trim 模式的 offset），附加信息必须能序列化为 JSON
+    """
+    value: bytes
+    meta: dict[str, Any]
+
+
+# 磁盘文件格式：魔数 + 4 字节大端的 JSON 附加信息长度 + 附加信息 + 内容
+_DISK_MAGIC = b'RBC1'
+_DISK_HEADER = struct.Struct('>4sI')
+
+
+class ResultCache:
+    """
+    两级结果缓存
+
+    内存层为按字节数限制容量的 LRU；磁盘层可选，写入 disk_dir 下按键分片的文件，重启后仍然有效。
+    磁盘层由多个进程（uvicorn workers）共用：读取时直接按键查找文件，其它进程写入的条目同样可以命中；
+    命中时更新文件的修改时间，容量超出时扫描整个目录按修改时间淘汰最旧的文件，容量限制对所有进程合计生效。
+    磁盘命中的条目会提升到内存层。
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: str = '', disk_max_bytes: int = 0, name: str = 'result'):
+        """
+        :param max_bytes: 内存层最大字节数，0 表示不使用内存层
+        :param disk_dir: 磁盘层目录，为空表示不使用磁盘层
+        :param disk_max_bytes: 磁盘层最大字节数，0 表示不限制
+        :param name: 指标中的缓存名称
+        """
+        self._hit_metric = CACHE_LOOKUPS.labels(name, 'hit')
+        self._miss_metric = CACHE_LOOKUPS.labels(name, 'miss')
+        self.max_bytes = max(0, max_bytes)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = max(0, disk_max_bytes)
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._memory_bytes = 0
+        # 磁盘层的条目数和字节数：最近一次扫描目录的结果加上之后本进程写入的量，超出容量时重新扫描
+        self._disk_entries = 0
+        self._disk_bytes = 0
+        self._disk_scan_lock = threading.Lock()
+        self._counters = {'memoryHits': 0, 'diskHits': 0, 'misses': 0, 'memoryEvictions': 0, 'diskEvictions': 0}
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_entries, self._disk_bytes = len(files := self._scan_disk()), sum(size for _, _, size in files)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _scan_disk(self) -> list[tuple[float, str, int]]:
+        """
+        :return: 目录中所有缓存文件 [(修改时间, 路径, 字节数)]，按修改时间从旧到新
+        """
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # 其它进程刚刚淘汰了这个文件
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        entries.sort()
+        return entries
+
+    @staticmethod
+    def _entry_size(entry: CacheEntry) -> int:
+        return len(entry.value) + (len(json.dumps(entry.meta)) if entry.meta else 0)
+
+    def get(self, key: str) -> CacheEntry | None:
+        """
+        读取缓存，未命中返回 None
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._counters['memoryHits'] += 1
+                self._hit_metric.inc()
+                return entry
+        entry = self._get_disk(key) if self.disk_dir else None
+        if entry is not None:
+            with self._lock:
+                self._counters['diskHits'] += 1
+                self._put_memory(key, entry)
+            self._hit_metric.inc()
+            return entry
+        with self._lock:
+            self._counters['misses'] += 1
+        self._miss_metric.inc()
+        return None
+
+    def _get_disk(self, key: str) -> CacheEntry | None:
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            # 更新修改时间，所有进程按同一个 LRU 顺序淘汰
+            os.utime(path)
+        except OSError:
+            return None
+        if len(data) < _DISK_HEADER.size:
+            return None
+        magic, meta_size = _DISK_HEADER.unpack_from(data)
+        if magic != _DISK_MAGIC:
+            # 旧格式或损坏的文件，当作未命中，稍后被新结果覆盖
+            return None
+        meta_end = _DISK_HEADER.size + meta_size
+        meta = json.loads(data[_DISK_HEADER.size:meta_end]) if meta_size else {}
+        return CacheEntry(data[meta_end:], meta)
+
+    def put(self, key: str, value: bytes, meta: dict[str, Any] | None = None):
+        """
+        写入缓存，同时写入内存层和磁盘层
+        :param meta: 附加信息，读取时原样返回
+        """
+        entry = CacheEntry(value, meta or {})
+        with self._lock:
+            self._put_memory(key, entry)
+        if self.disk_dir:
+            self._put_disk(key, entry)
+
+    def _put_memory(self, key: str, entry: CacheEntry):
+        size = self._entry_size(entry)
+        if size > self.max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= self._entry_size(old)
+        self._memory[key] = entry
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= self._entry_size(evicted)
+            self._counters['memoryEvictions'] += 1
+
+    def _put_disk(self, key: str, entry: CacheEntry):
+        path = self._disk_path(key)
+        meta = json.dumps(entry.meta).encode('utf-8') if entry.meta else b''
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，多个进程共用一个目录时不会读到半个文件
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as file:
+                file.write(_DISK_HEADER.pack(_DISK_MAGIC, len(meta)))
+                file.write(meta)
+                file.write(entry.value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            get_logger('removebg').warning(f"write result cache {path} failed: {e}")
+            return
+
+        with self._lock:
+            self._disk_entries += 1
+            self._disk_bytes += _DISK_HEADER.size + len(meta) + len(entry.value)
+            over_limit = self.disk_max_bytes and self._disk_bytes > self.disk_max_bytes
+        if over_limit:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """
+        扫描整个目录（包括其它进程写入的文件），从最旧的文件开始删除，直到低于容量的 90%，
+        留出余量，避免每次写入都重新扫描
+        """
+        if not self._disk_scan_lock.acquire(blocking=False):
+            # 本进程已经在淘汰
+            return
+        try:
+            files = self._scan_disk()
+            total = sum(size for _, _, size in files)
+            target = self.disk_max_bytes * 0.9
+            evicted = 0
+            for _, path, size in files[:-1]:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                evicted += 1
+            with self._lock:
+                self._disk_entries = len(files) - evicted
+                self._disk_bytes = total
+                self._counters['diskEvictions'] += evicted
+        finally:
+            self._disk_scan_lock.release()
+
+    def stats(self) -> dict[str, Any]:
+        """
+        命中/未命中计数、淘汰数与容量使用情况；磁盘层的条目数和字节数是所有进程合计的估计值
+        """
+        with self._lock:
+            hits = self._counters['memoryHits'] + self._counters['diskHits']
+            lookups = hits + self._counters['misses']
+            return {
+                **self._counters,
+                'hitRate': round(hits / lookups, 4) if lookups else 0.0,
+                'memoryEntries': len(self._memory),
+                'memoryBytes': self._memory_bytes,
+                'memoryMaxBytes': self.max_bytes,
+                'diskEntries': self._disk_entries,
+                'diskBytes': self._disk_bytes,
+                'diskMaxBytes': self.disk_max_bytes,
+            }
+
+
+class MaskCache:
+    """
+    整图遮罩缓存
+
+    按图片内容哈希缓存模型输出的整图遮罩。保存的是放大之前的模型分辨率遮罩，既控制内存，
+    也使命中与未命中时都只从同一份遮罩用 resize_mask 放大一次，结果相同。
+    不同的框选区域、输出格式、特效都可以复用同一次推理。
+    """
+
+    def __init__(self, max_bytes: int, model_size: tuple[int, int] = (1024, 1024)):
+        """
+        :param max_bytes: 最大字节数
+        :param model_size: 保存分辨率 (height, width)
+        """
+        self.model_size = model_size
+        self._cache = ResultCache(max_bytes, name='mask')
+
+    def get(self, key: str, image_size: tuple[int, int]) -> np.ndarray | None:
+        """
+        :param key: 图片内容哈希
+        :param image_size: 原图尺寸 (height, width)
+        :return: 原图尺寸的遮罩 (height, width)，uint8；未命中返回 None
+        """
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        mask = np.frombuffer(entry.value, dtype=np.uint8).reshape(self.model_size)
+        return resize_mask(mask, image_size)
+
+    def put(self, key: str, mask: np.ndarray):
+        """
+        :param key: 图片内容哈希
+        :param mask: 模型分辨率（model_size）的遮罩，uint8，放大到原图尺寸之前的结果
+        """
+        mask = np.squeeze(mask)
+        if mask.shape != tuple(self.model_size):
+            raise ValueError(f"mask cache expects a {self.model_size} mask, got {mask.shape}")
+        self._cache.put(key, np.ascontiguousarray(mask, dtype=np.uint8).tobytes())
+
+    def stats(self) -> dict[str, Any]:
+        return self._cache.stats()
+
+
+_result_cache: ResultCache | None = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache | None:
+    """
+    全局结果缓存，由环境变量配置：
+    RESULT_CACHE_MEMORY_MB 内存层容量，RESULT_CACHE_DIR 磁盘层目录，RESULT_CACHE_DISK_MB 磁盘层容量。
+    内存层和磁盘层都未启用时返回 None
+    """
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                memory_bytes = get_env_int('RESULT_CACHE_MEMORY_MB', 256) * 1024 * 1024
+                disk_dir = os.environ.get('RESULT_CACHE_DIR', '').strip()
+                if memory_bytes <= 0 and not disk_dir:
+                    return None
+                _result_cache = ResultCache(memory_bytes, disk_dir, get_env_int('RESULT_CACHE_DISK_MB', 4096) * 1024 * 1024)
+    return _result_cache
+
+
+_mask_cache: MaskCache | None = None
+_mask_cache_lock = threading.Lock()
+
+
+def get_mask_cache() -> MaskCache | None:
+    """
+    全局整图遮罩缓存，容量由环境变量 MASK_CACHE_MB 配置，0（默认）表示不启用
+    """
+    global _mask_cache
+    if _mask_cache is None:
+        with _mask_cache_lock:
+            if _mask_cache is None:
+                max_bytes = get_env_int('MASK_CACHE_MB', 0) * 1024 * 1024
+                if max_bytes <= 0:
+                    return None
+                _mask_cache = MaskCache(max_bytes)
+    return _mask_cache
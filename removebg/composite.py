@@ -0,0 +1,46 @@
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+
+def resize_mask(mask: np.ndarray, size: tuple[int, int] | None) -> np.ndarray:
+    """
+    把模型分辨率的 uint8 遮罩放大（或缩小）到 size，推理结果和遮罩缓存都经由这里放大，结果一致
+    :param mask: 遮罩 (height, width)，uint8
+    :param size: 输出尺寸 (height, width)，None 或与 mask 相同时原样返回
+    :return: 遮罩 (height, width)，uint8
+    """
+    if size is None or mask.shape[:2] == tuple(size):
+        return mask
+    return cv2.resize(mask, (size[1], size[0]), interpolation=cv2.INTER_LINEAR)
+
+
+def mask_to_uint8(mask: torch.Tensor, size: tuple[int, int] | None = None) -> np.ndarray:
+    """
+    模型分辨率的遮罩张量转换为 uint8 遮罩，按最小/最大值归一化。
+    归一化和浮点运算都在模型分辨率上完成，放大到原图尺寸时只处理 uint8
+    :param mask: 遮罩张量 (1, 1, height, width) 或 (height, width)，取值 [0, 1]
+    :param size: 输出尺寸 (height, width)，默认保持模型分辨率
+    :return: 遮罩 (height, width)，uint8
+    """
+    mask = mask.detach().squeeze().float().cpu()
+    ma = torch.max(mask)
+    mi = torch.min(mask)
+    mask = (mask - mi) / (ma - mi)
+    return resize_mask((mask * 255).numpy().astype(np.uint8), size)
+
+
+def composite_rgba(image: Image.Image, alpha: np.ndarray) -> Image.Image:
+    """
+    把 alpha 直接写入解码后的像素，得到 RGBA 图片。
+    RGB 像素只扩展一次为 RGBA 缓冲区，遮罩按原样作为 alpha 通道写入（共享 numpy 内存，不复制），
+    不产生浮点副本，也不像 paste 那样逐像素混合
+    :param image: RGB 图片
+    :param alpha: 遮罩 (height, width)，uint8，与图片尺寸相同
+    :return: RGBA 图片
+    """
+    rgba = image.convert("RGBA")
+    alpha = np.ascontiguousarray(alpha)
+    rgba.putalpha(Image.frombuffer("L", image.size, alpha, "raw", "L", 0, 1))
+    return rgba
@@ -9,9 +9,12 @@ import requests
 
 from removebg import utils
 
+from .encoder import OUTPUT_FORMATS, PNG_STRATEGIES
 from .func import resolve_path
 from .logger import get_logger
 
+OUTPUT_MODES = ('rgba', 'mask', 'trim')
+
 
 class RemoveBgDTO(BaseModel):
     path: str = ''
@@ -19,7 +22,13 @@ class RemoveBgDTO(BaseModel):
     base64: str = ''
     selectPolygon: list[tuple[float, float]] = []
     editorSize: tuple[float, float] = (0, 0)
-    responseFormat: int = 0  # 0: base64 1: image/png
+    responseFormat: int = 0  # 0: base64 1: 图片二进制
+    outputMode: str = 'rgba'  # rgba: 完整画布 mask: 单通道遮罩 trim: 裁剪到前景边界框
+    outputFormat: str = 'png'  # png / webp（无损）/ webp-lossy（有损，alpha 无损）
+    quality: int = 80  # WebP 质量 0-100，无损 WebP 时表示压缩力度
+    pngCompressLevel: int = 6  # PNG 的 zlib 压缩级别 0-9
+    pngStrategy: str = 'default'  # PNG 的 zlib 压缩策略：default / filtered / huffman / rle / fixed
+    profile: bool = False  # 返回各阶段耗时，设置了 PROFILE_DIR 时同时保存 cProfile / torch profiler trace
 
     def check(self) -> tuple[int, str]:
         if not self.path and not self.url and not self.base64:
@@ -34,6 +43,44 @@ class RemoveBgDTO(BaseModel):
             except Exception as e:
                 get_logger('removebg').exception(msg="RemoveBgDTO check failed", exc_info=e)
                 return 120, f"url: {self.url} is not valid url!"
+        return self.check_output()
+
+    def check_output(self) -> tuple[int, str]:
+        """
+        检查输出编码参数
+        """
+        if self.outputMode not in OUTPUT_MODES:
+            return 150, f"outputMode: {self.outputMode} must be one of {', '.join(OUTPUT_MODES)}"
+        if self.outputFormat not in OUTPUT_FORMATS:
+            return 150, f"outputFormat: {self.outputFormat} must be one of {', '.join(OUTPUT_FORMATS)}"
+        if not 0 <= self.quality <= 100:
+            return 150, f"quality: {self.quality} must be in [0, 100]"
+        if not 0 <= self.pngCompressLevel <= 9:
+            return 150, f"pngCompressLevel: {self.pngCompressLevel} must be in [0, 9]"
+        if self.pngStrategy not in PNG_STRATEGIES:
+            return 150, f"pngStrategy: {self.pngStrategy} must be one of {', '.join(PNG_STRATEGIES)}"
         return 0, "OK"
-    
 
+    @classmethod
+    def from_query(cls, select_polygon: str = '', editor_size: str = '', response_format: int = 1,
+                   **output_params) -> 'RemoveBgDTO':
+        """
+        由查询参数构造，供二进制上传接口使用
+        :param select_polygon: 多边形坐标 x1,y1,x2,y2,...
+        :param editor_size: 编辑器尺寸 width,height
+        :param response_format: 返回的数据类型
+        :param output_params: 输出参数 outputMode / outputFormat / quality / pngCompressLevel / pngStrategy
+        :raise ValueError: 参数格式错误
+        """
+        dto = cls(responseFormat=response_format, **output_params)
+        if select_polygon.strip():
+            values = [float(value) for value in select_polygon.split(',')]
+            if len(values) % 2 != 0:
+                raise ValueError(f"selectPolygon: {select_polygon} must be x1,y1,x2,y2,...")
+            dto.selectPolygon = list(zip(values[0::2], values[1::2]))
+        if editor_size.strip():
+            values = [float(value) for value in editor_size.split(',')]
+            if len(values) != 2:
+                raise ValueError(f"editorSize: {editor_size} must be width,height")
+            dto.editorSize = (values[0], values[1])
+        return dto
@@ -0,0 +1,95 @@
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+from .executor import BoundedExecutor
+from .func import get_env_int
+
+# outputFormat => (Pillow 格式, Content-Type)
+OUTPUT_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),  # 无损 WebP
+    'webp-lossy': ('WEBP', 'image/webp'),  # 有损 WebP，alpha 通道仍然无损
+}
+
+# pngStrategy => zlib 压缩策略
+PNG_STRATEGIES = {
+    'default': zlib.Z_DEFAULT_STRATEGY,
+    'filtered': zlib.Z_FILTERED,
+    'huffman': zlib.Z_HUFFMAN_ONLY,
+    'rle': zlib.Z_RLE,
+    'fixed': zlib.Z_FIXED,
+}
+
+
+def media_type(output_format: str) -> str:
+    """
+    输出格式对应的 Content-Type
+    """
+    return OUTPUT_FORMATS[output_format][1]
+
+
+def encode_image(image: Image.Image, output_format: str = 'png', quality: int = 80, png_compress_level: int = 6,
+                 png_strategy: str = 'default') -> bytes:
+    """
+    编码图片
+    :param image: 待编码的图片
+    :param output_format: png / webp（无损）/ webp-lossy（有损，alpha 无损）
+    :param quality: WebP 质量 0-100；无损 WebP 时表示压缩力度，越大越慢、文件越小
+    :param png_compress_level: PNG 的 zlib 压缩级别 0-9
+    :param png_strategy: PNG 的 zlib 压缩策略，见 PNG_STRATEGIES
+    :return: 编码后的字节
+    """
+    buffered = BytesIO()
+    if output_format == 'png':
+        image.save(buffered, format='PNG', compress_level=png_compress_level,
+                   compress_type=PNG_STRATEGIES[png_strategy])
+    elif output_format == 'webp':
+        image.save(buffered, format='WEBP', lossless=True, quality=quality, exact=False)
+    elif output_format == 'webp-lossy':
+        image.save(buffered, format='WEBP', lossless=False, quality=quality, alpha_quality=100)
+    else:
+        raise ValueError(f"unknown output format: {output_format}")
+    return buffered.getvalue()
+
+
+_encoder_pool: ThreadPoolExecutor | None = None
+_encode_executor: BoundedExecutor | None = None
+_encoder_pool_lock = threading.Lock()
+
+
+def _encode_workers() -> int:
+    workers = get_env_int('ENCODE_WORKERS', 0)
+    return workers if workers > 0 else os.cpu_count() or 1
+
+
+def get_encoder_pool() -> ThreadPoolExecutor:
+    """
+    全局编码线程池，线程数由环境变量 ENCODE_WORKERS 配置，默认 CPU 核数。
+    用于一个请求内部的并行任务（例如动图各帧的渲染和转换），调用方本身运行在有界执行器中，提交的任务数随之受限
+    """
+    global _encoder_pool
+    if _encoder_pool is None:
+        with _encoder_pool_lock:
+            if _encoder_pool is None:
+                _encoder_pool = ThreadPoolExecutor(max_workers=_encode_workers(), thread_name_prefix='encoder-pool')
+    return _encoder_pool
+
+
+def get_encode_executor() -> BoundedExecutor:
+    """
+    全局编码执行器：推理完成后的结果在这里编码，推理执行器的线程可以立即处理下一个请求。
+    Pillow 编码 PNG/WebP 时会释放 GIL，多个编码可以并行；
+    线程数 ENCODE_WORKERS（默认 CPU 核数），最大排队数 ENCODE_QUEUE_SIZE（默认 32），
+    编码跟不上推理时排队的是解码后的整图，超出上限直接抛出 QueueFullError（HTTP 503），内存占用不会无限增长
+    """
+    global _encode_executor
+    if _encode_executor is None:
+        with _encoder_pool_lock:
+            if _encode_executor is None:
+                _encode_executor = BoundedExecutor(_encode_workers(), get_env_int('ENCODE_QUEUE_SIZE', 32), 'encoder')
+    return _encode_executor
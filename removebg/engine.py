@@ -0,0 +1,314 @@
+import itertools
+import multiprocessing
+import os
+import secrets
+import signal
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Connection, Listener
+
+import numpy as np
+import psutil
+import torch
+
+from .func import get_env_int, get_env_float
+from .logger import get_logger
+from .metrics import mark_process_dead
+
+_ENGINE_HOST = '127.0.0.1'
+
+
+def _engine_count() -> int:
+    # 共享推理进程数，0 表示每个进程自己加载模型
+    return get_env_int('INFERENCE_PROCESSES', 0)
+
+
+def _engine_ports() -> list[int]:
+    base_port = get_env_int('INFERENCE_ENGINE_PORT', 10087)
+    return [base_port + i for i in range(_engine_count())]
+
+
+def _engine_authkey() -> bytes:
+    return os.environ.get('INFERENCE_ENGINE_AUTHKEY', '').encode('utf-8')
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    # 共享内存由客户端创建和释放，推理进程只是借用。
+    # 推理进程和 HTTP 进程都由 start.py 以 spawn 方式启动，共用同一个 resource_tracker，
+    # 重复登记同一名称不会产生副作用；Python 3.13+ 可以直接跳过登记
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+class EngineClient:
+    """
+    共享推理进程的客户端
+
+    图片像素写入客户端创建的共享内存，只通过连接发送共享内存名称和尺寸；
+    推理进程把遮罩写回同一块共享内存的尾部。布局：[RGB height*width*3][MASK mask_height*mask_width]，
+    输入可以是缩小解码的图片，遮罩按 mask 尺寸输出
+    """
+
+    def __init__(self, ports: list[int], authkey: bytes):
+        """
+        :param ports: 推理进程监听的端口列表
+        :param authkey: 连接认证密钥
+        """
+        self.ports = ports
+        self.authkey = authkey
+        self._local = threading.local()
+        self._counter = itertools.count()
+
+    def _connection(self) -> Connection:
+        # Connection 不是线程安全的，每个线程一个连接，轮流分配到各个推理进程
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            port = self.ports[next(self._counter) % len(self.ports)]
+            conn = Client((_ENGINE_HOST, port), authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def _close_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def _request(self, message: tuple) -> tuple[str, str]:
+        """
+        发送请求并等待结果。连接断开时（推理进程崩溃后由 start.py 重启）轮流重连各个推理进程，
+        最多等待 INFERENCE_ENGINE_RETRY_SECONDS 秒；已发出的请求只重发一次，避免同一个请求反复让推理进程崩溃
+        """
+        deadline = time.monotonic() + get_env_float('INFERENCE_ENGINE_RETRY_SECONDS', 60)
+        resent = False
+        while True:
+            try:
+                conn = self._connection()
+            except OSError:
+                # 推理进程正在重启，还没有开始监听
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.5)
+                continue
+            try:
+                conn.send(message)
+                return conn.recv()
+            except (EOFError, OSError):
+                self._close_connection()
+                if resent:
+                    raise
+                resent = True
+
+    def status(self) -> list[dict[str, int | bool]]:
+        """
+        各推理进程的存活状态：每个端口新建一个连接发送 ping，1 秒内应答视为存活
+        :return: [{'port': 端口, 'alive': 是否存活}]
+        """
+        result = []
+        for port in self.ports:
+            try:
+                with Client((_ENGINE_HOST, port), authkey=self.authkey) as conn:
+                    conn.send(('ping',))
+                    alive = conn.poll(1) and conn.recv()[0] == 'ok'
+            except (EOFError, OSError):
+                alive = False
+            result.append({'port': port, 'alive': alive})
+        return result
+
+    def predict_mask(self, image: np.ndarray, mask_size: tuple[int, int] | None = None,
+                     trace_path: str = '') -> np.ndarray:
+        """
+        计算遮罩
+        :param image: RGB 图片数组，形状 (height, width, 3)，uint8
+        :param mask_size: 输出遮罩尺寸 (height, width)，默认与 image 相同
+        :param trace_path: 不为空时推理进程把该批次的 torch profiler trace 写入此路径
+        :return: 遮罩，形状 mask_size，uint8
+        """
+        height, width = image.shape[:2]
+        mask_height, mask_width = mask_size or (height, width)
+        shm = shared_memory.SharedMemory(create=True, size=height * width * 3 + mask_height * mask_width)
+        try:
+            buffer = np.ndarray((height, width, 3), dtype=np.uint8, buffer=shm.buf)
+            buffer[...] = image
+            del buffer
+            status, msg = self._request((shm.name, height, width, mask_height, mask_width, trace_path))
+            if status != 'ok':
+                raise RuntimeError(f"inference engine failed: {msg}")
+            return np.ndarray((mask_height, mask_width), dtype=np.uint8, buffer=shm.buf,
+                              offset=height * width * 3).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+
+
+_client: EngineClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_engine_client() -> EngineClient | None:
+    """
+    获取共享推理进程客户端，未配置 INFERENCE_PROCESSES 时返回 None
+    """
+    global _client
+    if _client is None and _engine_count() > 0:
+        with _client_lock:
+            if _client is None:
+                _client = EngineClient(_engine_ports(), _engine_authkey())
+    return _client
+
+
+def _handle_connection(conn: Connection, batcher):
+    log = get_logger('removebg')
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if message == ('ping',):
+                    conn.send(('ok', ''))
+                    continue
+                shm_name, height, width, mask_height, mask_width, trace_path = message
+                shm = _attach_shared_memory(shm_name)
+                try:
+                    image = np.ndarray((height, width, 3), dtype=np.uint8, buffer=shm.buf)
+                    mask = batcher.run((image, (mask_height, mask_width), trace_path))
+                    output = np.ndarray((mask_height, mask_width), dtype=np.uint8, buffer=shm.buf,
+                                        offset=height * width * 3)
+                    output[...] = mask
+                    del image, output
+                finally:
+                    try:
+                        shm.close()
+                    except BufferError:
+                        # 仍有异常回溯引用着共享内存，交给垃圾回收释放
+                        log.warning(f"shared memory {shm_name} still referenced, close deferred")
+                conn.send(('ok', ''))
+            except Exception as e:
+                log.exception(msg="inference engine request failed", exc_info=e)
+                try:
+                    conn.send(('error', str(e)))
+                except (EOFError, OSError):
+                    return
+
+
+def run_engine(index: int, ready):
+    """
+    推理进程入口：加载一份模型，监听本地端口，把各个 HTTP 进程的请求合并成批次推理
+    :param index: 推理进程序号，监听端口为 INFERENCE_ENGINE_PORT + index
+    :param ready: 模型加载完成后置位的事件
+    """
+    from .batcher import MicroBatcher
+    from .worker import predict_masks, _predict_mask_batch
+
+    # 推理进程由 start.py 管理和停止，终端的 Ctrl+C 不应让它先于 HTTP 进程退出（否则会被当作崩溃重启）
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    log = get_logger('removebg')
+    threads = get_env_int('INFERENCE_THREADS', 0)
+    if threads <= 0:
+        cores = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+        threads = max(1, int(cores) // max(1, _engine_count()))
+    torch.set_num_threads(threads)
+
+    # 预热：加载模型并跑一次推理
+    predict_masks([np.zeros((32, 32, 3), dtype=np.uint8)])
+    batcher = MicroBatcher(_predict_mask_batch,
+                           max_batch_size=get_env_int('BATCH_MAX_SIZE', 8),
+                           max_wait_ms=get_env_float('BATCH_MAX_WAIT_MS', 10),
+                           name=f'inference-engine-{index}')
+
+    port = _engine_ports()[index]
+    with Listener((_ENGINE_HOST, port), authkey=_engine_authkey()) as listener:
+        log.info(f"inference engine {index} listening on {_ENGINE_HOST}:{port} with {threads} threads")
+        ready.set()
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                log.warning(f"inference engine {index} rejected a connection: {e}")
+                continue
+            threading.Thread(target=_handle_connection, args=(conn, batcher), daemon=True).start()
+
+
+def _start_engine(ctx, index: int):
+    ready = ctx.Event()
+    process = ctx.Process(target=run_engine, args=(index, ready), name=f'inference-engine-{index}', daemon=True)
+    process.start()
+    return process, ready
+
+
+def _wait_ready(process: multiprocessing.Process, ready):
+    while not ready.wait(timeout=1):
+        if not process.is_alive():
+            raise RuntimeError(f"{process.name} exited with code {process.exitcode}")
+
+
+_stop_supervisor = threading.Event()
+
+
+def _supervise(ctx, engines: list[multiprocessing.Process], interval: float = 1.0):
+    """
+    监视推理进程，退出（崩溃、被 OOM killer 杀死等）后在同一端口重新启动；
+    连续启动失败时等待时间逐次加倍，最长 60 秒。HTTP 进程的客户端在连接断开后自动重连
+    """
+    log = get_logger('removebg')
+    failures = [0] * len(engines)
+    retry_at = [0.0] * len(engines)
+    while not _stop_supervisor.wait(interval):
+        for index, process in enumerate(engines):
+            if process.is_alive() or time.monotonic() < retry_at[index] or _stop_supervisor.is_set():
+                continue
+            log.error(f"{process.name} exited with code {process.exitcode}, restarting")
+            # 重启失败时会再次经过这里，重复删除同一个 pid 的文件没有影响
+            mark_process_dead(process.pid)
+            try:
+                process, ready = _start_engine(ctx, index)
+                engines[index] = process
+                _wait_ready(process, ready)
+                failures[index] = 0
+                log.info(f"{process.name} restarted")
+            except RuntimeError as e:
+                failures[index] += 1
+                retry_at[index] = time.monotonic() + min(60, 2 ** failures[index])
+                log.error(f"restart inference engine {index} failed: {e}")
+
+
+def start_engines() -> list[multiprocessing.Process]:
+    """
+    按 INFERENCE_PROCESSES 启动共享推理进程，并等待模型加载完成；之后由后台线程监视，退出的推理进程会被重新启动。
+    必须在启动 HTTP 进程之前调用，HTTP 进程通过继承的环境变量找到推理进程。
+    :return: 推理进程列表，未配置时为空；重启后列表中的进程会被替换
+    """
+    count = _engine_count()
+    if count <= 0:
+        return []
+    if not os.environ.get('INFERENCE_ENGINE_AUTHKEY'):
+        os.environ['INFERENCE_ENGINE_AUTHKEY'] = secrets.token_hex(16)
+
+    ctx = multiprocessing.get_context('spawn')
+    started = [_start_engine(ctx, i) for i in range(count)]
+    for process, ready in started:
+        _wait_ready(process, ready)
+    engines = [process for process, _ in started]
+    _stop_supervisor.clear()
+    threading.Thread(target=_supervise, args=(ctx, engines), name='inference-engine-supervisor', daemon=True).start()
+    return engines
+
+
+def stop_engines(engines: list[multiprocessing.Process]):
+    """
+    停止监视并结束推理进程，HTTP 服务退出后调用
+    :param engines: start_engines 的返回值
+    """
+    _stop_supervisor.set()
+    for process in engines:
+        process.terminate()
+    for process in engines:
+        process.join(timeout=5)
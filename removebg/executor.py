@@ -0,0 +1,137 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from .func import get_env_int
+from .metrics import EXECUTOR_REJECTED, EXECUTOR_TASKS
+
+
+class QueueFullError(Exception):
+    """
+    执行器排队已满，调用方应当拒绝请求（HTTP 503）
+    """
+    pass
+
+
+class BoundedExecutor:
+    """
+    有界线程池执行器
+
+    最多同时执行 max_workers 个任务，最多排队 queue_size 个任务，
+    超出时 submit 直接抛出 QueueFullError，而不是无限堆积占用内存。
+    """
+
+    def __init__(self, max_workers: int, queue_size: int, name: str = 'removebg'):
+        """
+        :param max_workers: 工作线程数
+        :param queue_size: 最大排队任务数
+        :param name: 线程名前缀，也是指标中的执行器名称
+        """
+        self.max_workers = max(1, max_workers)
+        self.queue_size = max(0, queue_size)
+        self.name = name
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._rejected_metric = EXECUTOR_REJECTED.labels(name)
+        self._task_metrics = {state: EXECUTOR_TASKS.labels(name, state) for state in ('queued', 'running')}
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.queue_size)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """
+        提交任务
+        :raise QueueFullError: 执行中和排队中的任务已达上限
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            self._rejected_metric.inc()
+            raise QueueFullError(f"executor {self.name} is full: {self.max_workers} running, {self.queue_size} queued")
+        with self._lock:
+            self._queued += 1
+        self._task_metrics['queued'].inc()
+        # 是否已经开始执行；排队中被取消的任务不会执行 _run，名额在完成回调中统一归还
+        started = [False]
+        try:
+            # 在提交方的上下文中运行，任务可以看到调用方的 contextvars（例如当前请求的性能分析对象）
+            context = contextvars.copy_context()
+            future = self._pool.submit(context.run, self._run, started, time.monotonic(), fn, *args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._queued -= 1
+            self._task_metrics['queued'].dec()
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._release(started))
+        return future
+
+    def _run(self, started: list[bool], submit_time: float, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        wait = time.monotonic() - submit_time
+        with self._lock:
+            started[0] = True
+            self._queued -= 1
+            self._running += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        self._task_metrics['queued'].dec()
+        self._task_metrics['running'].inc()
+        return fn(*args, **kwargs)
+
+    def _release(self, started: list[bool]):
+        # 任务完成、失败或在排队中被取消（例如客户端断开）时都会调用，归还名额
+        with self._lock:
+            if started[0]:
+                self._running -= 1
+                self._completed += 1
+            else:
+                self._queued -= 1
+        self._task_metrics['running' if started[0] else 'queued'].dec()
+        self._slots.release()
+
+    def stats(self) -> dict[str, Any]:
+        """
+        执行器运行状态：容量、当前排队深度、等待时间等
+        """
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                'workers': self.max_workers,
+                'queueSize': self.queue_size,
+                'running': self._running,
+                'queued': self._queued,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'avgWaitMs': round(self._wait_total / started * 1000, 2) if started else 0.0,
+                'maxWaitMs': round(self._wait_max * 1000, 2),
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+
+_executor: BoundedExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> BoundedExecutor:
+    """
+    获取全局推理执行器，容量由环境变量配置：
+    EXECUTOR_WORKERS 工作线程数，默认与 BATCH_MAX_SIZE 相同，保证能凑满一个批次；
+    EXECUTOR_QUEUE_SIZE 最大排队数，默认 32
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = get_env_int('EXECUTOR_WORKERS', 0)
+                if workers <= 0:
+                    workers = get_env_int('BATCH_MAX_SIZE', 8)
+                _executor = BoundedExecutor(workers, get_env_int('EXECUTOR_QUEUE_SIZE', 32))
+    return _executor
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .func import get_env_int, get_env_float
+from .metrics import stage
+
+
+class FetchError(Exception):
+    """
+    下载图片失败：状态码错误、超时、超过大小限制等
+    """
+    pass
+
+
+class ImageFetcher:
+    """
+    共享的图片下载器
+
+    使用带连接池的 Session 复用 keep-alive 连接（避免每张图片重新握手 TLS），
+    设置连接/读取/总超时，流式读取并限制最大字节数，用信号量限制并发下载数。
+    """
+
+    def __init__(self, connect_timeout: float = 3, read_timeout: float = 10, total_timeout: float = 30,
+                 max_bytes: int = 30 * 1024 * 1024, max_concurrency: int = 16, pool_size: int = 16):
+        """
+        :param connect_timeout: 连接超时（秒）
+        :param read_timeout: 两次读取之间的超时（秒）
+        :param total_timeout: 整个下载的超时（秒）
+        :param max_bytes: 响应体最大字节数
+        :param max_concurrency: 最大并发下载数
+        :param pool_size: 每个域名保持的连接数
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.total_timeout = total_timeout
+        self.max_bytes = max_bytes
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def fetch(self, url: str) -> bytes:
+        """
+        下载图片
+        :param url: 图片地址
+        :return: 响应体字节
+        :raise FetchError: 下载失败
+        """
+        with self._slots, stage('fetch'):
+            deadline = time.monotonic() + self.total_timeout
+            try:
+                with self._session.get(url, stream=True, timeout=self.timeout) as response:
+                    if response.status_code != 200:
+                        raise FetchError(f"get image from {url} failed, status: {response.status_code}")
+                    content_length = int(response.headers.get('Content-Length') or 0)
+                    if content_length > self.max_bytes:
+                        raise FetchError(f"get image from {url} failed, {content_length} bytes exceeds limit")
+                    chunks = []
+                    size = 0
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise FetchError(f"get image from {url} failed, body exceeds {self.max_bytes} bytes")
+                        if time.monotonic() > deadline:
+                            raise FetchError(f"get image from {url} failed, timeout after {self.total_timeout}s")
+                        chunks.append(chunk)
+                    return b''.join(chunks)
+            except requests.RequestException as e:
+                raise FetchError(f"get image from {url} failed: {e}") from e
+
+    async def fetch_async(self, url: str) -> bytes:
+        """
+        在线程池中下载，供 async 接口使用，不阻塞事件循环
+        """
+        return await asyncio.to_thread(self.fetch, url)
+
+
+_fetcher: ImageFetcher | None = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher() -> ImageFetcher:
+    """
+    全局图片下载器，由环境变量配置：FETCH_CONNECT_TIMEOUT / FETCH_READ_TIMEOUT / FETCH_TOTAL_TIMEOUT（秒），
+    FETCH_MAX_MB 最大图片大小，FETCH_CONCURRENCY 最大并发下载数，FETCH_POOL_SIZE 每个域名的连接数
+    """
+    global _fetcher
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = ImageFetcher(connect_timeout=get_env_float('FETCH_CONNECT_TIMEOUT', 3),
+                                        read_timeout=get_env_float('FETCH_READ_TIMEOUT', 10),
+                                        total_timeout=get_env_float('FETCH_TOTAL_TIMEOUT', 30),
+                                        max_bytes=get_env_int('FETCH_MAX_MB', 30) * 1024 * 1024,
+                                        max_concurrency=get_env_int('FETCH_CONCURRENCY', 16),
+                                        pool_size=get_env_int('FETCH_POOL_SIZE', 16))
+    return _fetcher
@@ -1,9 +1,20 @@
+import glob
+import multiprocessing
 import os
 import re
 import sys
+import threading
+import time
+from queue import Empty
+from typing import Any, Callable
 
+import psutil
 from pydantic import BaseModel
 
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+_GLOB_CHARS = ('*', '?', '[')
+
 
 def get_executable_directory():
     if getattr(sys, 'frozen', False):  # 判断是否为打包后的可执行文件
@@ -54,6 +65,30 @@ def is_http_url(url):
     return bool(pattern.match(url))
 
 
+def is_glob(source: str) -> bool:
+    """
+    判断给定的字符串是否是 glob 表达式（URL 中的 ? 不算）。
+
+    :param source: 待检查的字符串
+    :return: 包含 glob 通配符且不是 URL 时返回 True
+    """
+    return not is_http_url(source) and any(char in source for char in _GLOB_CHARS)
+
+
+def list_images(image_dir: str) -> list[str]:
+    """
+    列出目录下的图片文件，按文件名排序
+
+    :param image_dir: 图片目录，不递归查找子目录
+    :return: 图片路径列表
+    """
+    paths = []
+    for extension in IMAGE_EXTENSIONS:
+        paths.extend(glob.glob(os.path.join(image_dir, f"*{extension}")))
+        paths.extend(glob.glob(os.path.join(image_dir, f"*{extension.upper()}")))
+    return sorted(set(paths))
+
+
 def resolve_path(path):
     """
     判断给定的路径是绝对路径还是相对路径，并将相对路径转换为绝对路径。
@@ -70,3 +105,107 @@ def resolve_path(path):
         current_dir = os.getcwd()
         absolute_path = os.path.join(current_dir, path)
         return absolute_path
+
+
+def get_env_int(name: str, default: int) -> int:
+    """
+    读取整数类型的环境变量，未设置或格式错误时返回默认值。
+
+    :param name: 环境变量名
+    :param default: 默认值
+    :return: 整数值
+    """
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value.strip())
+    except ValueError:
+        return default
+
+
+def get_env_float(name: str, default: float) -> float:
+    """
+    读取浮点类型的环境变量，未设置或格式错误时返回默认值。
+
+    :param name: 环境变量名
+    :param default: 默认值
+    :return: 浮点值
+    """
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return float(value.strip())
+    except ValueError:
+        return default
+
+
+def _measure_case(build: Callable[..., tuple[Callable[[], Any], str]], args: tuple, repeat: int, queue):
+    # 在独立的进程中运行，峰值内存互不影响
+    try:
+        run, size = build(*args)
+    except Exception as e:
+        queue.put({'error': f"{type(e).__name__}: {e}"})
+        return
+
+    process = psutil.Process()
+    baseline = process.memory_info().rss
+    peak = baseline
+    running = True
+
+    def sample():
+        nonlocal peak
+        while running:
+            peak = max(peak, process.memory_info().rss)
+            time.sleep(0.002)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    timings = []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = run()
+            timings.append((time.perf_counter() - start) * 1000)
+            peak = max(peak, process.memory_info().rss)
+            del result
+    except Exception as e:
+        queue.put({'error': f"{type(e).__name__}: {e}"})
+        return
+    finally:
+        running = False
+        sampler.join()
+    queue.put({'size': size, 'ms': round(min(timings), 2), 'peakMb': round((peak - baseline) / 1024 / 1024, 1)})
+
+
+def measure_in_subprocess(build: Callable[..., tuple[Callable[[], Any], str]], args: tuple = (),
+                          repeat: int = 3) -> dict[str, Any]:
+    """
+    在新的 spawn 进程中测量一个基准用例的耗时和峰值内存，各用例的内存互不影响。
+
+    :param build: 模块级函数（子进程中按名称导入），build(*args) 准备输入并返回 (待测函数, 输入尺寸描述)，
+                  准备过程不计入耗时和内存
+    :param args: build 的参数
+    :param repeat: 待测函数的运行次数，取最快的一次
+    :return: {'size': 输入尺寸描述, 'ms': 最快一次的毫秒数, 'peakMb': 相对准备完成时的峰值内存增量 (MB)}
+    :raise RuntimeError: 准备或运行失败
+    """
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_measure_case, args=(build, args, repeat, queue))
+    process.start()
+    try:
+        while True:
+            try:
+                result = queue.get(timeout=1)
+                break
+            except Empty:
+                # 子进程崩溃（例如内存不足被杀死）时不会写入结果
+                if not process.is_alive() and queue.empty():
+                    raise RuntimeError(f"benchmark process exited with code {process.exitcode}")
+    finally:
+        process.join()
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    return result
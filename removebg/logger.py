@@ -1,7 +1,17 @@
+import atexit
+import json
 import logging
 import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from enum import Enum
-from .func import get_executable_directory
+from logging.handlers import QueueHandler, QueueListener
+
+from .func import get_executable_directory, get_env_float, get_env_int
 
 
 class LogLevel(Enum):
@@ -36,27 +46,185 @@ def get_log_level(level: str) -> int:
     return global_log_level.value
 
 
-def get_logger(name: str, level: LogLevel = LogLevel.UNSET, file_name: str = 'app') -> logging.Logger:
-    log_dir = os.path.join(get_executable_directory(), 'logs')
-    if not os.path.exists(log_dir):
-        os.mkdir(log_dir)
-    log_file_path = os.path.join(log_dir, f"{file_name}.log")
-    log = logging.getLogger(name)
+class RequestContext:
+    """
+    当前请求的日志上下文：请求 ID 和各阶段累计耗时（毫秒）
+    """
 
-    log_level = global_log_level if level == LogLevel.UNSET else level
-    formatter = logging.Formatter('%(asctime)s - %(name)s:%(filename)s:%(lineno)d[%(levelname)s] - %(message)s')
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.stages: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record_stage(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+
+    def timings(self) -> dict[str, float]:
+        with self._lock:
+            return {name: round(ms, 2) for name, ms in self.stages.items()}
+
+
+_request_context: ContextVar[RequestContext | None] = ContextVar('removebg_request_context', default=None)
+
+
+@contextmanager
+def request_context(request_id: str):
+    """
+    在 with 块内设置当前请求的日志上下文，块内（包括用 contextvars.copy_context() 运行的线程池任务）
+    记录的日志都带有该请求 ID
+    """
+    context = RequestContext(request_id)
+    token = _request_context.set(context)
+    try:
+        yield context
+    finally:
+        _request_context.reset(token)
+
+
+def current_request_id() -> str:
+    """
+    :return: 当前请求 ID，不在请求中时为空字符串
+    """
+    context = _request_context.get()
+    return context.request_id if context is not None else ''
+
+
+def record_stage(name: str, seconds: float):
+    """
+    把一个阶段的耗时计入当前请求的日志上下文，不在请求中时不做任何事
+    """
+    context = _request_context.get()
+    if context is not None:
+        context.record_stage(name, seconds)
+
+
+class _ContextFilter(logging.Filter):
+    # 在调用方线程中运行：补充请求 ID，并按 LOG_SAMPLE_RATE 丢弃标记为 sampled 的高频日志
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, 'sampled', False) and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return False
+        record.request_id = current_request_id() or '-'
+        return True
+
+
+class _DroppingQueueHandler(QueueHandler):
+    # 队列已满时丢弃日志并计数，记录日志的线程永远不会被磁盘或控制台阻塞
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # 退出时队列可能是满的，等待后台线程腾出位置
+        self.queue.put(self._sentinel)
+
+
+# 日志记录中的标准属性，其余属性（extra）在 json 格式中作为字段输出
+_RECORD_ATTRS = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime', 'request_id',
+                                                                                'sampled', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    每条日志输出一行 JSON，便于日志系统按 requestId、阶段耗时等字段检索
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        content = {'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))
+                           + f".{int(record.msecs):03d}",
+                   'level': record.levelname, 'logger': record.name, 'file': record.filename, 'line': record.lineno,
+                   'pid': record.process, 'requestId': getattr(record, 'request_id', '-'),
+                   'message': record.getMessage()}
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                content[key] = value
+        return json.dumps(content, ensure_ascii=False, default=str)
+
+
+_handlers: dict[str, QueueHandler] = {}
+_handlers_lock = threading.Lock()
+_listeners: list[QueueListener] = []
+
+
+def _stop_listeners():
+    # 退出前写完队列中剩余的日志
+    for listener in _listeners:
+        listener.stop()
+
+
+def _get_handler(file_name: str) -> QueueHandler:
+    """
+    每个日志文件只初始化一次：创建目录和格式，由后台线程写控制台和文件，记录日志的线程只把日志放入队列
+    """
+    handler = _handlers.get(file_name)
+    if handler is not None:
+        return handler
+    with _handlers_lock:
+        handler = _handlers.get(file_name)
+        if handler is not None:
+            return handler
+        log_dir = os.path.join(get_executable_directory(), 'logs')
+        os.makedirs(log_dir, exist_ok=True)
+        if os.environ.get('LOG_FORMAT', 'text').strip().lower() == 'json':
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter(
+                '%(asctime)s - %(name)s:%(filename)s:%(lineno)d[%(levelname)s] %(request_id)s - %(message)s')
 
-    if not log.handlers:  # Avoid adding duplicate handlers
-        # 创建控制台处理器
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.DEBUG)
         console_handler.setFormatter(formatter)
-        log.addHandler(console_handler)
+        file_handler = logging.FileHandler(os.path.join(log_dir, f"{file_name}.log"), encoding='utf-8')
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=max(0, get_env_int('LOG_QUEUE_SIZE', 10000)))
+        listener = _Listener(log_queue, console_handler, file_handler, respect_handler_level=True)
+        listener.start()
+        if not _listeners:
+            atexit.register(_stop_listeners)
+        _listeners.append(listener)
+
+        handler = _DroppingQueueHandler(log_queue)
+        handler.setLevel(logging.DEBUG)
+        handler.addFilter(_ContextFilter(get_env_float('LOG_SAMPLE_RATE', 1)))
+        _handlers[file_name] = handler
+        return handler
+
+
+def dropped_log_records() -> int:
+    """
+    :return: 因日志队列已满而丢弃的日志条数
+    """
+    return sum(handler.dropped for handler in _handlers.values())
 
-        info_handler = logging.FileHandler(log_file_path, encoding='utf-8')
-        info_handler.setLevel(logging.DEBUG)
-        info_handler.setFormatter(formatter)
-        log.addHandler(info_handler)
 
+def get_logger(name: str, level: LogLevel = LogLevel.UNSET, file_name: str = 'app') -> logging.Logger:
+    """
+    获取日志记录器，日志异步写入控制台和 logs/{file_name}.log；
+    高频日志可以用 extra={'sampled': True} 标记，按 LOG_SAMPLE_RATE 采样记录
+    """
+    log = logging.getLogger(name)
+    if not log.handlers:  # Avoid adding duplicate handlers
+        handler = _get_handler(file_name)
+        with _handlers_lock:
+            if not log.handlers:
+                log.addHandler(handler)
+                # 父记录器（例如 removebg.access 的 removebg）可能使用同一个处理器，不再向上传递以免重复
+                log.propagate = False
+
+    log_level = global_log_level if level == LogLevel.UNSET else level
     log.setLevel(log_level.value)  # 设置日志记录器级别
     return log
@@ -0,0 +1,79 @@
+import os
+import time
+from contextlib import contextmanager
+
+import psutil
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, \
+    generate_latest, multiprocess
+
+from .profiling import record
+
+# 设置了 PROMETHEUS_MULTIPROC_DIR 时（start.py 默认设置），各个 HTTP 进程和共享推理进程把指标写入该目录，
+# 任何一个进程的 /metrics 都汇总所有进程的数据。该变量必须在导入本模块之前设置
+
+REQUESTS = Counter('removebg_requests', 'HTTP requests by endpoint, HTTP status and result code',
+                   ['endpoint', 'status', 'code'])
+REQUEST_SECONDS = Histogram('removebg_request_seconds', 'HTTP request latency in seconds', ['endpoint'],
+                            buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60))
+BATCH_ITEMS = Counter('removebg_batch_items', 'Items of POST /removebg/batch by result code', ['code'])
+STAGE_SECONDS = Histogram('removebg_stage_seconds',
+                          'Pipeline stage time in seconds; preprocess / inference / postprocess are per batch',
+                          ['stage'],
+                          buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+BATCH_SIZE = Histogram('removebg_inference_batch_size', 'Images per inference batch',
+                       buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32))
+EXECUTOR_TASKS = Gauge('removebg_executor_tasks', 'Tasks in the bounded executors by executor (removebg / encoder) '
+                       'and state (queued / running)', ['executor', 'state'], multiprocess_mode='livesum')
+EXECUTOR_REJECTED = Counter('removebg_executor_rejected', 'Tasks rejected because the executor queue was full',
+                            ['executor'])
+CACHE_LOOKUPS = Counter('removebg_cache_lookups', 'Cache lookups by cache and result (hit / miss)',
+                        ['cache', 'result'])
+PROCESS_RSS = Gauge('removebg_process_rss_bytes', 'Resident memory of the process', multiprocess_mode='liveall')
+
+
+@contextmanager
+def stage(name: str):
+    """
+    记录一个处理阶段的耗时，同时计入当前请求的日志和性能分析结果
+    :param name: 阶段名称：fetch / decode / preprocess / inference / postprocess / composite / sunshine / encode
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        record(name, elapsed)
+
+
+_process = psutil.Process()
+
+
+def update_process_rss():
+    """
+    更新当前进程的常驻内存
+    """
+    PROCESS_RSS.set(_process.memory_info().rss)
+
+
+def mark_process_dead(pid: int):
+    """
+    删除已退出进程的 live 模式仪表盘文件，避免 EXECUTOR_TASKS、PROCESS_RSS 等继续汇总该进程最后的值
+    :param pid: 已退出进程的 pid
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """
+    生成 Prometheus 文本格式的指标
+    :return: (内容, Content-Type)
+    """
+    update_process_rss()
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,155 @@
+import cProfile
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable
+
+from .func import get_env_float
+from .logger import current_request_id, get_logger, record_stage
+
+_current: ContextVar['RequestProfile | None'] = ContextVar('removebg_profile', default=None)
+# cProfile 与 torch profiler 同一时刻只能有一个在运行，每个进程只抓取一个请求的 trace
+_trace_lock = threading.Lock()
+
+
+class RequestProfile:
+    """
+    单个请求的性能分析结果：各阶段耗时，以及可选的 cProfile / torch profiler trace 文件
+    """
+
+    def __init__(self, trace_dir: str = ''):
+        """
+        :param trace_dir: trace 文件目录，为空时只统计阶段耗时
+        """
+        # 与日志中的请求 ID 一致，便于对照
+        self.request_id = current_request_id() or uuid.uuid4().hex[:12]
+        self.stages: dict[str, float] = {}
+        self.trace_dir = trace_dir
+        self.trace_files: list[str] = []
+        self._cprofile = cProfile.Profile() if trace_dir else None
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+
+    def trace_path(self, suffix: str) -> str:
+        """
+        :return: trace 文件路径，未开启 trace 时为空字符串
+        """
+        if not self.trace_dir:
+            return ''
+        path = os.path.join(self.trace_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{self.request_id}.{suffix}")
+        with self._lock:
+            self.trace_files.append(path)
+        return path
+
+    def timings(self) -> dict[str, float]:
+        """
+        :return: 各阶段耗时（毫秒），total 为开始分析至今的总耗时
+        """
+        with self._lock:
+            timings = {name: round(ms, 2) for name, ms in self.stages.items()}
+        timings['total'] = round((time.perf_counter() - self._start) * 1000, 2)
+        return timings
+
+    def server_timing(self) -> str:
+        """
+        :return: Server-Timing 响应头，例如 decode;dur=12.5, inference;dur=830.1
+        """
+        return ', '.join(f"{name};dur={ms}" for name, ms in self.timings().items())
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        if self._cprofile is None:
+            return fn(*args, **kwargs)
+        return self._cprofile.runcall(fn, *args, **kwargs)
+
+    def _finish(self):
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(self.trace_path('prof'))
+            self._cprofile = None
+
+
+def start_profile(requested: bool = False) -> RequestProfile | None:
+    """
+    决定是否分析当前请求：请求中带有分析开关，或按 PROFILE_SAMPLE_RATE 随机采样。
+    设置了 PROFILE_DIR 且本进程没有其它请求正在抓取时，同时保存 cProfile 和 torch profiler trace
+    :param requested: 请求中的分析开关
+    :return: 不分析时返回 None，调用方什么都不用做
+    """
+    if not requested:
+        rate = get_env_float('PROFILE_SAMPLE_RATE', 0)
+        if rate <= 0 or random.random() >= rate:
+            return None
+    # 推理进程也会写入 trace 文件，使用绝对路径
+    trace_dir = os.path.abspath(os.environ['PROFILE_DIR']) if os.environ.get('PROFILE_DIR') else ''
+    if trace_dir and _trace_lock.acquire(blocking=False):
+        os.makedirs(trace_dir, exist_ok=True)
+        return RequestProfile(trace_dir)
+    return RequestProfile()
+
+
+@contextmanager
+def profile_request(profile: RequestProfile | None):
+    """
+    在 with 块内把 profile 设为当前请求的分析对象，离开时保存 trace 并记录日志；profile 为 None 时不做任何事。
+    线程池中的任务需要用 contextvars.copy_context() 运行才能看到当前的分析对象
+    """
+    if profile is None:
+        yield None
+        return
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+        try:
+            profile._finish()
+        finally:
+            if profile.trace_dir:
+                _trace_lock.release()
+        timings = profile.timings()
+        get_logger('removebg').info(f"profile {profile.request_id}: {timings}"
+                                    + (f", traces: {profile.trace_files}" if profile.trace_files else ''),
+                                    extra={'timings': timings, 'traces': profile.trace_files})
+
+
+def current_profile() -> RequestProfile | None:
+    return _current.get()
+
+
+def record(name: str, seconds: float):
+    """
+    记录当前请求的一个阶段耗时，计入请求日志；当前请求开启了性能分析时同时计入分析结果
+    """
+    record_stage(name, seconds)
+    profile = _current.get()
+    if profile is not None:
+        profile.record(name, seconds)
+
+
+@contextmanager
+def timed(name: str):
+    """
+    只记录到当前请求的日志和分析结果中，不计入 /metrics，用于按请求拆分的阶段（例如等待批次推理的耗时）
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def profiled_call(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    调用 fn；当前请求开启了 trace 时在 cProfile 中运行
+    """
+    profile = _current.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    return profile.call(fn, *args, **kwargs)
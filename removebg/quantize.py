@@ -0,0 +1,112 @@
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from .backend import MODEL_INPUT_SIZE, get_onnx_path, get_quantized_onnx_path, export_onnx
+from .func import list_images
+from .worker import _preprocess_image
+
+
+def _load_input(path: str) -> tuple[torch.Tensor, tuple[int, int]]:
+    # 与 worker 相同的预处理：RGB、缩放到模型输入尺寸、归一化
+    image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"decode image {path} failed")
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return _preprocess_image(image, MODEL_INPUT_SIZE), (image.shape[0], image.shape[1])
+
+
+class _CalibrationReader:
+    """
+    onnxruntime 静态量化的校准数据，逐张读取样本图片
+    """
+
+    def __init__(self, paths: list[str], input_name: str):
+        self.paths = iter(paths)
+        self.input_name = input_name
+
+    def get_next(self) -> dict[str, np.ndarray] | None:
+        path = next(self.paths, None)
+        if path is None:
+            return None
+        input_tensor, _ = _load_input(path)
+        return {self.input_name: input_tensor.numpy()}
+
+
+def quantize_onnx(method: str = 'static', calibration_dir: str = '', output_path: str = '',
+                  max_calibration_images: int = 16) -> str:
+    """
+    生成 INT8 量化的 ONNX 模型，fp32 ONNX 模型不存在时先导出
+
+    :param method: static 静态量化（需要校准图片，精度更好）或 dynamic 动态量化（无需校准）
+    :param calibration_dir: 校准图片目录，静态量化必填
+    :param output_path: 输出路径，默认 get_quantized_onnx_path()
+    :param max_calibration_images: 最多使用的校准图片数
+    :return: 输出路径
+    """
+    from onnxruntime import InferenceSession
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, \
+        quantize_static
+
+    onnx_path = get_onnx_path()
+    if not os.path.isfile(onnx_path):
+        export_onnx(onnx_path)
+    output_path = output_path or get_quantized_onnx_path()
+
+    if method == 'dynamic':
+        quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QUInt8)
+        return output_path
+    if method != 'static':
+        raise ValueError(f"unknown quantization method: {method}")
+
+    paths = list_images(calibration_dir)[:max_calibration_images]
+    if not paths:
+        raise ValueError(f"no calibration images found in {calibration_dir}")
+    input_name = InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    quantize_static(onnx_path, output_path, _CalibrationReader(paths, input_name),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    calibrate_method=CalibrationMethod.MinMax)
+    return output_path
+
+
+def compare_masks(reference, candidate, image_dir: str) -> dict:
+    """
+    在一个目录的图片上比较两个推理后端的遮罩精度和耗时
+
+    :param reference: 基准后端（通常是 fp32）
+    :param candidate: 待评估后端（通常是 INT8）
+    :param image_dir: 图片目录
+    :return: 报告，包含每张图片及平均的 mask IoU（alpha >= 0.5 视为前景）与平均 alpha 绝对误差
+    """
+    rows = []
+    for path in list_images(image_dir):
+        input_tensor, size = _load_input(path)
+        start = time.perf_counter()
+        reference_mask = reference.predict(input_tensor, [size])[0].squeeze().cpu().numpy()
+        reference_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        candidate_mask = candidate.predict(input_tensor, [size])[0].squeeze().cpu().numpy()
+        candidate_ms = (time.perf_counter() - start) * 1000
+
+        reference_fg = reference_mask >= 0.5
+        candidate_fg = candidate_mask >= 0.5
+        union = np.count_nonzero(reference_fg | candidate_fg)
+        iou = np.count_nonzero(reference_fg & candidate_fg) / union if union else 1.0
+        rows.append({
+            'image': os.path.basename(path),
+            'iou': round(float(iou), 5),
+            'alphaMae': round(float(np.abs(reference_mask - candidate_mask).mean()), 5),
+            'referenceMs': round(reference_ms, 1),
+            'candidateMs': round(candidate_ms, 1),
+        })
+
+    summary = {}
+    if rows:
+        for key in ('iou', 'alphaMae', 'referenceMs', 'candidateMs'):
+            summary[key] = round(float(np.mean([row[key] for row in rows])), 5)
+        summary['minIou'] = min(row['iou'] for row in rows)
+    return {'images': rows, 'mean': summary}
@@ -1,3 +1,6 @@
+import threading
+from concurrent.futures import Executor
+
 import cv2
 import numpy as np
 
@@ -47,86 +50,131 @@ def _find_intersection_points(rect : cv2.typing.Rect, point1: cv2.typing.Point,
 
     return intersection_points
 
-def _blend_images(base: cv2.Mat, overlay: cv2.Mat) -> cv2.Mat:
-    """
-    将两张大小相同的 BGRA 图像合并（叠加）。
-    :param base: 底层图像（BGRA 格式）。
-    :param overlay: 叠加图像（BGRA 格式）。
-    :return: 合并后的图像（BGRA 格式）。
-    """
-    # 分离 Alpha 通道
-    base_rgb = base[:, :, :3]
-    base_alpha = base[:, :, 3] / 255.0
+# 光照线宽度和模糊核大小
+_LINE_THICKNESS = 25
+_BLUR_SIZE = 51
+# 光照线半宽（含抗锯齿）加上模糊半径，遮罩外接矩形向外扩展这么多像素之外的光照强度恒为 0
+_MARGIN = _LINE_THICKNESS // 2 + 2 + _BLUR_SIZE // 2
+# 按行分条混合，每条只处理光照强度非 0 的列范围
+_STRIP_ROWS = 64
+_FRAME_COUNT = 7
+# 每个线程复用自己的 float32 条带缓冲区，宽度不够时才重新分配
+_strip_buffers = threading.local()
 
-    overlay_rgb = overlay[:, :, :3]
-    overlay_alpha = overlay[:, :, 3] / 255.0
 
-    # 计算合并后的 Alpha 通道
-    out_alpha = overlay_alpha + base_alpha * (1 - overlay_alpha)
+def _light_map(rect: cv2.typing.Rect, roi: cv2.typing.Rect, index: int) -> np.ndarray:
+    """
+    在 roi 范围内绘制一帧的单通道光照强度图
+    :param rect: 遮罩的外接矩形
+    :param roi: 光照可能影响的区域 (x, y, w, h)
+    :param index: 帧序号，从 1 开始
+    :return: (roi 高, roi 宽) 的 uint8 数组
+    """
+    x, y, w, h = rect
+    rx, ry, rw, rh = roi
+    # 划分7段需要8个节点
+    xstep = w / 8
+    ystep = h / 8
+    # 计算当前分割线位置, 对角线方向
+    top_right = (int(x + index * xstep), int(y + (index - 1) * ystep))
+    bottom_left = (int(x + (index - 1) * xstep), int(y + index * ystep))
+    rect_point1, rect_point2 = _find_intersection_points(rect, top_right, bottom_left)
 
-    # 防止除以 0 的情况
-    out_alpha_safe = np.where(out_alpha == 0, 1, out_alpha)
+    light = np.zeros((rh, rw), dtype=np.uint8)
+    # 白色光照线的 4 个通道完全相同，只绘制一个通道
+    cv2.line(light, (rect_point1[0] - rx, rect_point1[1] - ry), (rect_point2[0] - rx, rect_point2[1] - ry), 255,
+             _LINE_THICKNESS, lineType=cv2.LINE_AA)
+    # roi 边缘留有足够的 0，与在整图上模糊的结果相同
+    return cv2.GaussianBlur(light, (_BLUR_SIZE, _BLUR_SIZE), 0)
 
-    # 计算合并后的 RGB 通道
-    out_rgb = np.zeros_like(base_rgb, dtype=np.float32)  # 初始化为零
-    valid_mask = out_alpha > 0  # 仅处理有效的像素
-    out_rgb[valid_mask] = (
-        (overlay_rgb[valid_mask] * overlay_alpha[valid_mask, None] +
-         base_rgb[valid_mask] * base_alpha[valid_mask, None] * (1 - overlay_alpha[valid_mask, None]))
-        / out_alpha_safe[valid_mask, None]
-    )
 
-    # 合并 RGB 和 Alpha 通道
-    out_image = np.dstack((out_rgb, out_alpha * 255)).astype(np.uint8)
+def _get_strip_buffers(width: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    获取当前线程的条带缓冲区，每个条带使用其中的一部分
+    :param width: 需要的列数
+    :return: (光照, 权重, 颜色) 三个 float32 缓冲区
+    """
+    buffers = getattr(_strip_buffers, 'buffers', None)
+    if buffers is None or buffers[0].shape[1] < width:
+        buffers = (np.empty((_STRIP_ROWS, width), dtype=np.float32),
+                   np.empty((_STRIP_ROWS, width), dtype=np.float32),
+                   np.empty((_STRIP_ROWS, width, 3), dtype=np.float32))
+        _strip_buffers.buffers = buffers
+    return buffers
 
-    return out_image
 
-def sunshine(source: cv2.Mat, mask: cv2.Mat, removebg: bool) -> list[cv2.Mat]:
+def _blend_light(frame: cv2.Mat, source: cv2.Mat, alpha: cv2.Mat | None, light: np.ndarray, roi: cv2.typing.Rect):
+    """
+    把白色光照层按 alpha 合成叠加到 frame 的颜色通道上，只处理光照强度非 0 的部分
+    :param frame: 输出帧（4 通道），光照以外的部分已经填好
+    :param source: 原图（3 通道）
+    :param alpha: 原图的 alpha（removebg 时为遮罩），None 表示不透明
+    :param light: roi 范围内的光照强度图
+    """
+    rx, ry, rw, rh = roi
+    light_buffer, weight_buffer, rgb_buffer = _get_strip_buffers(rw)
+    for top in range(0, rh, _STRIP_ROWS):
+        bx, by, bw, bh = cv2.boundingRect(light[top:top + _STRIP_ROWS])
+        if bw == 0:
+            continue
+        x0, y0 = rx + bx, ry + top + by
+        # l: 光照层的颜色和不透明度（0-1），t: 原图在结果中的权重 a_b * (1 - l)
+        l = light_buffer[:bh, :bw]
+        t = weight_buffer[:bh, :bw]
+        rgb = rgb_buffer[:bh, :bw]
+        np.multiply(light[top + by:top + by + bh, bx:bx + bw], np.float32(1 / 255), out=l)
+        np.subtract(1, l, out=t)
+        if alpha is not None:
+            t *= alpha[y0:y0 + bh, x0:x0 + bw]
+            t *= np.float32(1 / 255)
+        # 结果 = (255 * l * l + 原图 * t) / (l + t)，即白色与原图按 l、t 加权平均
+        np.multiply(source[y0:y0 + bh, x0:x0 + bw], t[:, :, np.newaxis], out=rgb)
+        rgb += (l * l * 255)[:, :, np.newaxis]
+        t += l
+        # 完全透明且没有光照的像素分子也为 0，结果为 0
+        np.maximum(t, np.float32(1e-6), out=t)
+        rgb /= t[:, :, np.newaxis]
+        rgb += 0.5
+        frame[y0:y0 + bh, x0:x0 + bw, :3] = rgb
+
+
+def sunshine(source: cv2.Mat, mask: cv2.Mat, removebg: bool, executor: Executor | None = None) -> list[cv2.Mat]:
     """
-    处理图片的光照效果
+    处理图片的光照效果：光照只出现在遮罩外接矩形及其模糊边缘内，各帧只在该区域内绘制单通道的光照强度图，
+    并只对光照非 0 的部分做 float32 混合。白色光照与通道顺序无关，传入 RGB 原图时得到 RGBA 帧
     :param source: 原图图片
     :param mask: 原图核心区域的遮罩
     :param removebg: 是否去除原图背景
-    :return: 处理后的图片列表
+    :param executor: 可选的线程池，各帧并行渲染（OpenCV 和 numpy 运算释放 GIL）
+    :return: 处理后的图片列表（BGRA，alpha 为遮罩）
     """
     # 如果 mask 是 (H, W, 1)，去掉最后一个维度
-    if mask.shape[-1] == 1:  
+    if mask.shape[-1] == 1:
         mask = np.squeeze(mask, axis=-1)
-
-    source = cv2.cvtColor(source, cv2.COLOR_BGR2BGRA)
-    if removebg:
-        # 设置 Alpha 通道：黑色区域 (mask == 0) 设置为透明
-        source[:, :, 3] = mask
+    height, width = mask.shape[:2]
 
     rect = cv2.boundingRect(mask)
     x, y, w, h = rect
-
-    # 划分7段需要8个节点
-    xstep = w / 8  
-    ystep = h / 8
-
-    sunshine_images = []
-    for i in range(1, 8):
-        # 计算当前分割线位置, 对角线方向
-        top_right = (int(x + i * xstep), int(y + (i-1) * ystep))
-        bottom_left = (int(x + (i-1) * xstep), int(y + i * ystep))
-
-        rect_point1, rect_point2 = _find_intersection_points(rect, top_right, bottom_left)
-
-        # 创建图像副本
-        canvas = source.copy()
-        # 创建光照层（带透明度））
-        overlay = np.zeros((source.shape[0], source.shape[1], 4), dtype=np.uint8)
-    
-        # 绘制光照线
-        cv2.line(overlay, rect_point1, rect_point2, (255, 255, 255, 255), 25, lineType=cv2.LINE_AA)
-        
-        # 应用高斯模糊
-        overlay = cv2.GaussianBlur(overlay, (51, 51), 0)
-        
-        # 混合图像（柔和效果）
-        blended_image = _blend_images(canvas, overlay)
-        blended_image[:, :, 3] = mask 
-        sunshine_images.append(blended_image)
-    
-    return sunshine_images
\ No newline at end of file
+    left, top = max(0, x - _MARGIN), max(0, y - _MARGIN)
+    right, bottom = min(width, x + w + _MARGIN), min(height, y + h + _MARGIN)
+    roi = (left, top, right - left, bottom - top)
+
+    # 没有光照的像素：去除背景时完全透明的部分为黑色，其余为原图
+    base = cv2.bitwise_and(source, source, mask=mask) if removebg else source
+    alpha = mask if removebg else None
+    # 各帧写入同一块预先分配的内存
+    frames = np.empty((_FRAME_COUNT, height, width, 4), dtype=np.uint8)
+
+    def render(index: int):
+        frame = frames[index - 1]
+        frame[:, :, :3] = base
+        frame[:, :, 3] = mask
+        _blend_light(frame, source, alpha, _light_map(rect, roi, index), roi)
+
+    indexes = range(1, _FRAME_COUNT + 1)
+    if executor is None:
+        for index in indexes:
+            render(index)
+    else:
+        list(executor.map(render, indexes))
+    return list(frames)
@@ -3,7 +3,7 @@ import base64
 import os
 import cv2
 import numpy as np
-import requests
+from .fetcher import FetchError, get_fetcher
 from .logger import get_logger
 from .func import get_executable_directory, is_http_url
 
@@ -16,11 +16,11 @@ def read_image_to_mat(path_or_url: str, base64_data: str) -> cv2.Mat:
     log = get_logger("removebg")
     try:
         if is_http_url(path_or_url):
-            response = requests.get(path_or_url)
-            if response.status_code != 200:
-                log.error(f"get image from {path_or_url} failed")
+            try:
+                image_data = get_fetcher().fetch(path_or_url)
+            except FetchError as e:
+                log.error(str(e))
                 return None
-            image_data = response.content
             image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_UNCHANGED)
             if image is None:
                 log.error(f"decode image from {path_or_url} failed")
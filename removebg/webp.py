@@ -1,21 +1,29 @@
 import io
+from concurrent.futures import Executor
+
 from PIL import Image
 import cv2
 import numpy as np
 
-def create_webp_animation_from_cv2(images: list[cv2.Mat], duration=300) -> bytes:
+def create_webp_animation(images: list[np.ndarray], duration=300, lossless=False, quality=80,
+                          executor: Executor | None = None) -> bytes:
     """
-    将 OpenCV 图像列表组合成 WebP 动图。
-    
-    :param images: 包含 OpenCV 图像 (cv2.Mat) 的列表。
+    将 RGB / RGBA 数组列表组合成 WebP 动图。
+
+    :param images: RGB 或 RGBA 的 uint8 数组列表，RGBA 时保留透明度。
     :param duration: 每帧的间隔时间（毫秒）。
+    :param lossless: 是否无损编码。
+    :param quality: 有损编码的质量 0-100，无损时表示压缩力度。
+    :param executor: 可选的线程池，并行把各帧转换为 Pillow 图像。
     """
     # 确保有图片
     if not images:
         raise ValueError("未找到符合条件的图片！")
 
-    # 将 OpenCV 图像转换为 Pillow 图像
-    frames = [Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)) for img in images]
+    if executor is None:
+        frames = [Image.fromarray(img) for img in images]
+    else:
+        frames = list(executor.map(Image.fromarray, images))
 
     # 使用 BytesIO 保存到内存
     output_buffer = io.BytesIO()
@@ -25,11 +33,32 @@ def create_webp_animation_from_cv2(images: list[cv2.Mat], duration=300) -> bytes
         append_images=frames[1:],
         duration=duration,
         loop=0,  # 无限循环
+        lossless=lossless,
+        quality=quality,
         format="WEBP"
     )
-    output_buffer.seek(0)  # 重置指针到开头
     return output_buffer.getvalue()  # 返回字节数据
 
+
+def create_webp_animation_from_cv2(images: list[cv2.Mat], duration=300, executor: Executor | None = None) -> bytes:
+    """
+    将 OpenCV 图像列表组合成 WebP 动图。
+    
+    :param images: 包含 OpenCV 图像 (cv2.Mat) 的列表。
+    :param duration: 每帧的间隔时间（毫秒）。
+    :param executor: 可选的线程池，并行转换各帧的颜色顺序。
+    """
+    # 确保有图片
+    if not images:
+        raise ValueError("未找到符合条件的图片！")
+
+    # 将 OpenCV 图像转换为 RGB
+    def to_rgb(img: cv2.Mat) -> np.ndarray:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    rgb_images = [to_rgb(img) for img in images] if executor is None else list(executor.map(to_rgb, images))
+    return create_webp_animation(rgb_images, duration, executor=executor)
+
 # 示例调用
 if __name__ == "__main__":
     # 示例 OpenCV 图像列表
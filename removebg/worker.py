@@ -2,58 +2,114 @@ import base64
 import os
 import random
 import string
+import threading
 from io import BytesIO
 
+import cv2
 import numpy as np
-import requests
 import torch
-import torch.nn.functional as F
 from PIL import Image, ImageDraw
 from torchvision.transforms.functional import normalize
-from transformers import AutoModelForImageSegmentation
 
+from .backend import MODEL_INPUT_SIZE, get_backend
+from .batcher import MicroBatcher
+from .cache import CacheEntry, content_key, get_mask_cache, get_result_cache
+from .composite import composite_rgba, mask_to_uint8, resize_mask
 from .dto import RemoveBgDTO
-from .func import get_executable_directory
+from .encoder import encode_image, get_encoder_pool
+from .engine import get_engine_client
+from .fetcher import FetchError, get_fetcher
+from .func import get_env_int, get_env_float
 from .logger import get_logger
+from .metrics import BATCH_SIZE, stage, update_process_rss
+from .profiling import current_profile, profiled_call, timed
+from .sunshine import sunshine
+from .webp import create_webp_animation
 
-root_dir = get_executable_directory()
-model_dir = os.path.join(root_dir, 'model', 'briaai', 'RMBG-1.4')
-model = AutoModelForImageSegmentation.from_pretrained(model_dir, trust_remote_code=True)
-device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-model.to(device)
 
-
-def _read_image(dto: RemoveBgDTO) -> Image.Image | str:
+def _read_image_bytes(dto: RemoveBgDTO) -> bytes | str:
+    """
+    读取图片的原始字节（文件内容 / HTTP 响应体 / base64 解码结果）
+    :return: 图片字节，失败时返回错误信息
+    """
     msg = ""
     try:
         if dto.path:
             image_path = os.path.join(os.getcwd(), dto.path)
             msg = f"read image from {image_path} failed"
-            return Image.open(fp=image_path, mode='r')
+            with open(image_path, 'rb') as file:
+                return file.read()
         elif dto.url:
-            response = requests.get(dto.url)
             msg = f"get image from {dto.url} failed"
-            return Image.open(BytesIO(response.content))
+            return get_fetcher().fetch(dto.url)
         else:
             base64_string = dto.base64
             msg = f"parse base64 image failed"
             if ";base64," in base64_string:
                 base64_string = base64_string.split(";base64,")[-1]
-            image_data = base64.b64decode(base64_string)
-            return Image.open(BytesIO(image_data))
+            return base64.b64decode(base64_string)
+    except FetchError as e:
+        get_logger("removebg").error(str(e))
+        return msg
     except Exception as e:
         get_logger("removebg").exception("get image failed", exc_info=e)
         return msg
 
 
-def _crop_image_polygon_area(dto: RemoveBgDTO, image: Image.Image) -> Image.Image:
-    if len(dto.selectPolygon) < 3:
+def _load_image(image: Image.Image) -> str:
+    """
+    解码 Image.open 打开的图片，解码耗时计入 decode 阶段
+    :return: 失败时返回错误信息，成功时返回空字符串
+    """
+    try:
+        with stage('decode'):
+            image.load()
+        return ''
+    except Exception as e:
+        get_logger("removebg").exception("decode image failed", exc_info=e)
+        return "decode image failed"
+
+
+def _decode_model_image(image_data: bytes) -> Image.Image | None:
+    """
+    以缩小的分辨率解码 JPEG，只用于构造模型输入，解码耗时计入 decode 阶段。
+    JPEG 解码器可以直接按 1/2、1/4、1/8 缩放解码，耗时和内存都远小于全尺寸解码，
+    缩放后两边仍不小于模型输入尺寸
+    :param image_data: 图片字节
+    :return: 缩小解码的图片；非 JPEG 或图片不够大时返回 None，由调用方使用原图
+    """
+    try:
+        image = Image.open(BytesIO(image_data))
+        if image.format != 'JPEG':
+            return None
+        full_size = image.size
+        image.draft('RGB', (MODEL_INPUT_SIZE[1], MODEL_INPUT_SIZE[0]))
+        if image.size == full_size:
+            return None
+        with stage('decode'):
+            image.load()
         return image
+    except Exception as e:
+        get_logger("removebg").warning(f"reduced decode failed, fall back to full size: {e}")
+        return None
+
+
+def _select_region(dto: RemoveBgDTO, image_size: tuple[int, int]) \
+        -> tuple[tuple[int, int, int, int], np.ndarray | None]:
+    """
+    按编辑器缩放比例把 selectPolygon 换算到原图坐标，绘制多边形遮罩。
+    只需要原图尺寸，不需要解码原图；原图和缩小解码的模型输入都按这里得到的边界框裁剪
+    :param dto: 请求参数
+    :param image_size: 原图尺寸 (width, height)
+    :return: (框选区域在原图中的边界框 (left, top, right, bottom), 边界框内的多边形遮罩，uint8)；
+             未框选时为整图和 None
+    """
+    whole = (0, 0, image_size[0], image_size[1])
     if len(dto.selectPolygon) < 3:
-        return image
+        return whole, None
 
     # 根据缩放比例计算真实的多边形点的坐标
-    image_width, image_height = image.size
+    image_width, image_height = image_size
     editor_width, editor_height = dto.editorSize
     width_factor = 1 if editor_width <= 0 else image_width / editor_width
     height_factor = 1 if editor_height <= 0 else image_height / editor_height
@@ -75,88 +131,215 @@ def _crop_image_polygon_area(dto: RemoveBgDTO, image: Image.Image) -> Image.Imag
         real_points.append((point_x, point_y))
 
     # 创建一个和原图一样大小的透明mask
-    mask = Image.new("L", image.size, 0)
+    mask = Image.new("L", image_size, 0)
     # 使用ImageDraw在mask上绘制多边形，255表示完全不透明
     ImageDraw.Draw(mask).polygon(real_points, outline=255, fill=255)
 
-    # 创建一个白色背景图像
-    white_bg = Image.new("RGB", image.size, (255, 255, 255))
-
-    # 将原图像与mask合并，使未选中部分透明
-    image_with_alpha = image.convert("RGBA")
-    image_with_alpha.putalpha(mask)
-
-    # 将裁剪后的图像粘贴到白色背景图像上
-    white_bg.paste(image_with_alpha, (0, 0), image_with_alpha)
-
     # 使用mask来计算多边形的边界框
-    x_min, y_min, x_max, y_max = mask.getbbox()
-
-    # 根据边界框裁剪图像
-    cropped_image = white_bg.crop((x_min, y_min, x_max, y_max))
-
-    return cropped_image
+    bbox = mask.getbbox()
+    if bbox is None:
+        return whole, None
+    return bbox, np.asarray(mask.crop(bbox))
+
+
+def _model_region(image: Image.Image, source_size: tuple[int, int], bbox: tuple[int, int, int, int],
+                  polygon: np.ndarray | None) -> Image.Image:
+    """
+    构造框选区域的模型输入：按原图坐标的边界框裁剪，框选区域外填充白色
+    :param image: 原图或缩小解码的原图
+    :param source_size: 原图尺寸 (width, height)
+    :param bbox: _select_region 得到的原图坐标边界框
+    :param polygon: _select_region 得到的多边形遮罩，None 表示未框选
+    :return: RGB 图片，缩小解码时按同样的比例缩小，与原图的框选区域逐像素对齐
+    """
+    left, top, right, bottom = bbox
+    if polygon is None:
+        region = image
+    elif image.size == source_size:
+        region = image.crop(bbox)
+    else:
+        # 按浮点坐标的边界框重采样，不因缩小后的坐标取整而与原图区域错位
+        x_scale = image.size[0] / source_size[0]
+        y_scale = image.size[1] / source_size[1]
+        size = (max(1, round((right - left) * x_scale)), max(1, round((bottom - top) * y_scale)))
+        region = image.resize(size, Image.Resampling.BILINEAR,
+                              box=(left * x_scale, top * y_scale, right * x_scale, bottom * y_scale))
+        polygon = cv2.resize(polygon, size, interpolation=cv2.INTER_NEAREST)
+    # 去除alpha通道，已经是 RGB 时不再复制
+    if region.mode != "RGB":
+        region = region.convert("RGB")
+    if polygon is not None:
+        # 框选区域外填充白色
+        white_bg = Image.new("RGB", region.size, (255, 255, 255))
+        region = Image.composite(region, white_bg, Image.fromarray(polygon, mode='L'))
+    return region
 
 
 def _preprocess_image(im: np.ndarray, model_input_size: list) -> torch.Tensor:
     if len(im.shape) < 3:
         im = im[:, :, np.newaxis]
-    # orig_im_size=im.shape[0:2]
-    im_tensor = torch.tensor(im, dtype=torch.float32).permute(2, 0, 1)
-    im_tensor = F.interpolate(torch.unsqueeze(im_tensor, 0), size=model_input_size, mode='bilinear')
+    # 先在 uint8 上缩放到模型输入尺寸，再转换为 float32，避免生成原图尺寸的浮点张量
+    if im.shape[:2] != tuple(model_input_size):
+        im = cv2.resize(im, (model_input_size[1], model_input_size[0]), interpolation=cv2.INTER_LINEAR)
+        if len(im.shape) < 3:
+            im = im[:, :, np.newaxis]
+    im_tensor = torch.from_numpy(np.ascontiguousarray(im)).permute(2, 0, 1).unsqueeze(0).float()
     image = torch.divide(im_tensor, 255.0)
     image = normalize(image, [0.5, 0.5, 0.5], [1.0, 1.0, 1.0])
     return image
 
 
-def _post_process_image(tensor_ret: torch.Tensor, im_size: list) -> np.ndarray:
-    tensor_ret = torch.squeeze(F.interpolate(tensor_ret, size=im_size, mode='bilinear'), 0)
-    ma = torch.max(tensor_ret)
-    mi = torch.min(tensor_ret)
-    tensor_ret = (tensor_ret - mi) / (ma - mi)
-    im_array = (tensor_ret * 255).permute(1, 2, 0).cpu().data.numpy().astype(np.uint8)
-    im_array = np.squeeze(im_array)
-    return im_array
-
-
-def _remove_background(input_image: Image.Image) -> Image:
-    # 去除alpha通道
-    input_image = input_image.convert("RGB")
-    image_array = np.array(input_image)
+def predict_masks(images: list[np.ndarray], mask_sizes: list[tuple[int, int]] | None = None,
+                  trace_paths: list[str] | None = None) -> list[np.ndarray]:
+    """
+    批量计算前景遮罩：将多张图片缩放后堆叠为一个批次，一次推理完成
+    :param images: RGB 图片数组列表，形状 (height, width, 3)，uint8，可以是缩小解码的图片
+    :param mask_sizes: 输出遮罩尺寸 (height, width) 列表，默认与输入图片尺寸相同
+    :param trace_paths: 不为空时用 torch profiler 记录本批次的推理，chrome trace 写入其中每个路径
+    :return: 遮罩列表，形状 (height, width)，uint8，与输入一一对应
+    """
+    backend = get_backend()
+    BATCH_SIZE.observe(len(images))
     # 转换为 (height, width)
-    image_size = (input_image.size[1], input_image.size[0])
-    pre_precess = _preprocess_image(image_array, [1024, 1024]).to(device)
-
-    # inference
-    result = model(pre_precess)  # tuple 2*6
-
-    # post process
-    post_precess = _post_process_image(result[0][0], list(image_size))
-
-    # save result
-    pil_im = Image.fromarray(post_precess)
-    no_bg_image = Image.new("RGBA", pil_im.size, (0, 0, 0, 0))
-    no_bg_image.paste(input_image, mask=pil_im)
-
-    return no_bg_image
-
-
-def _save_as_base64(image: Image.Image) -> str:
-    buffered = BytesIO()
-    image.save(buffered, format="PNG")
-    img_byte = buffered.getvalue()
-    img_base64 = base64.b64encode(img_byte)
-    # Python 3.x 中 base64.b64encode() 返回的是 bytes，如果需要字符串形式，需要解码
-    img_base64_str = img_base64.decode('utf-8')
-    return img_base64_str
-
-
-def _save_as_bytes(image: Image.Image) -> bytes:
-    # 将图像保存到字节流
-    img_byte_array = BytesIO()
-    image.save(img_byte_array, format='PNG')
-    img_byte_array = img_byte_array.getvalue()
-    return img_byte_array
+    image_sizes = mask_sizes or [(image.shape[0], image.shape[1]) for image in images]
+    with stage('preprocess'):
+        pre_precess = torch.cat([_preprocess_image(image, MODEL_INPUT_SIZE) for image in images], dim=0)
+
+    # inference: 只计算 d1，输出模型分辨率的遮罩，不记录 autograd
+    with stage('inference'):
+        if trace_paths:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            with torch.profiler.profile(activities=activities, record_shapes=True) as profiler:
+                masks = backend.predict(pre_precess, [tuple(MODEL_INPUT_SIZE)] * len(images))
+            for trace_path in trace_paths:
+                profiler.export_chrome_trace(trace_path)
+        else:
+            masks = backend.predict(pre_precess, [tuple(MODEL_INPUT_SIZE)] * len(images))
+
+    # post process: 在模型分辨率上归一化为 uint8，再放大到原图尺寸
+    with stage('postprocess'):
+        return [mask_to_uint8(mask, size) for mask, size in zip(masks, image_sizes)]
+
+
+_batcher: MicroBatcher | None = None
+_batcher_lock = threading.Lock()
+
+
+def _get_batcher() -> MicroBatcher:
+    """
+    获取全局微批调度器，窗口大小由环境变量 BATCH_MAX_SIZE / BATCH_MAX_WAIT_MS 配置
+    """
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(_predict_mask_batch,
+                                        max_batch_size=get_env_int('BATCH_MAX_SIZE', 8),
+                                        max_wait_ms=get_env_float('BATCH_MAX_WAIT_MS', 10))
+    return _batcher
+
+
+def _predict_mask_batch(items: list[tuple[np.ndarray, tuple[int, int], str]]) -> list[np.ndarray]:
+    """
+    微批调度器的批处理函数
+    :param items: (RGB 图片数组, 遮罩尺寸 (height, width), torch profiler trace 路径或空字符串) 列表
+    """
+    masks = predict_masks([image for image, _, _ in items], [mask_size for _, mask_size, _ in items],
+                          [trace_path for _, _, trace_path in items if trace_path])
+    # 共享推理进程不处理 HTTP 请求，在这里更新它的内存指标
+    update_process_rss()
+    return masks
+
+
+def _predict_mask(image: np.ndarray, mask_size: tuple[int, int] | None = None) -> np.ndarray:
+    """
+    计算单张图片的遮罩：配置了共享推理进程时交给推理进程，否则交给本进程的微批调度器，
+    两种方式都会与其它并发请求合并推理
+    :param image: RGB 图片数组，可以是缩小解码的图片
+    :param mask_size: 输出遮罩尺寸 (height, width)，默认与 image 相同
+    """
+    mask_size = mask_size or (image.shape[0], image.shape[1])
+    profile = current_profile()
+    trace_path = profile.trace_path('torch.json') if profile is not None else ''
+    # 请求视角的推理耗时：包括等待凑批、预处理、推理和放大遮罩
+    with timed('inference'):
+        client = get_engine_client()
+        if client is not None:
+            return client.predict_mask(image, mask_size, trace_path)
+        return _get_batcher().run((image, mask_size, trace_path))
+
+
+def _compose_result(image: Image.Image | None, mask: np.ndarray, output_mode: str) -> Image.Image:
+    """
+    按 outputMode 生成结果：rgba 为完整画布的 RGBA 图片；mask 为单通道 8 位遮罩，不需要 image；
+    trim 为裁剪到 alpha 非零边界框的 RGBA 图片，左上角相对 image 的坐标写入 info['offset']
+    """
+    offset = (0, 0)
+    if output_mode == 'trim':
+        # 先裁剪再合成，只处理边界框内的像素
+        x, y, width, height = cv2.boundingRect(mask)
+        if width > 0 and height > 0:
+            mask = mask[y:y + height, x:x + width]
+            image = image.crop((x, y, x + width, y + height))
+            offset = (x, y)
+    if output_mode == 'mask':
+        return Image.fromarray(np.ascontiguousarray(mask), mode='L')
+    with stage('composite'):
+        result = composite_rgba(image, mask)
+    if output_mode == 'trim':
+        result.info['offset'] = offset
+    return result
+
+
+def _select_and_predict(dto: RemoveBgDTO, image_key: str, source: Image.Image,
+                        model_image: Image.Image | None = None) -> tuple[np.ndarray, tuple[int, int, int, int]]:
+    """
+    计算 selectPolygon 框选区域的遮罩。image_key 不为空时使用整图遮罩：同一张图片只推理一次，
+    不同的框选区域从缓存的整图遮罩中裁剪；否则框选区域外填充白色后推理。
+    有 model_image 时原图不会在这里解码，由调用方在需要合成时再解码
+    :param dto: 请求参数
+    :param image_key: 图片内容哈希，为空表示不使用整图遮罩缓存
+    :param source: 原图，可以是尚未解码的 Image.open 结果
+    :param model_image: 与原图内容相同的缩小图片，只用于推理；为 None 时使用原图（此时原图必须已经解码）
+    :return: (框选区域的遮罩，框选区域外为 0, 区域在原图中的边界框 (left, top, right, bottom))
+    """
+    bbox, polygon = _select_region(dto, source.size)
+    left, top, right, bottom = bbox
+    model_image = source if model_image is None else model_image
+    if not image_key:
+        region = _model_region(model_image, source.size, bbox, polygon)
+        mask = _predict_mask(np.asarray(region), (bottom - top, right - left))
+    else:
+        mask_cache = get_mask_cache()
+        image_size = (source.size[1], source.size[0])
+        mask = mask_cache.get(image_key, image_size)
+        if mask is None:
+            # 缓存放大之前的模型分辨率遮罩，命中与未命中都从它放大一次，结果相同
+            model_mask = _predict_mask(np.asarray(_model_region(model_image, source.size, bbox, None)),
+                                       tuple(MODEL_INPUT_SIZE))
+            mask_cache.put(image_key, model_mask)
+            mask = resize_mask(model_mask, image_size)
+            del model_mask
+        mask = mask[top:bottom, left:right]
+    if polygon is not None:
+        # 框选区域外的 alpha 置 0
+        mask = cv2.bitwise_and(mask, polygon)
+    return mask, bbox
+
+
+def _crop_source(source: Image.Image, bbox: tuple[int, int, int, int]) -> Image.Image | str:
+    """
+    解码原图并按边界框裁剪，只在需要合成 RGBA 结果时调用
+    :return: RGB 图片，解码失败时返回错误信息
+    """
+    msg = _load_image(source)
+    if msg:
+        return msg
+    image = source if bbox == (0, 0, source.size[0], source.size[1]) else source.crop(bbox)
+    # 去除alpha通道，已经是 RGB 时不再复制
+    return image if image.mode == "RGB" else image.convert("RGB")
 
 
 def _generate_random_filename(extension: str) -> str:
@@ -176,20 +359,200 @@ def _save_image_with_random_filename(img: Image.Image) -> str:
     return filepath
 
 
-def process(dto: RemoveBgDTO) -> tuple[int, str, bytes | str]:
-    code, msg = dto.check()
+def _decode_images(image_data: bytes) -> tuple[Image.Image, Image.Image | None] | str:
+    """
+    打开原图并准备模型输入。大 JPEG 以缩小的分辨率解码作为模型输入，原图只读取文件头，
+    推迟到需要合成时才全尺寸解码（outputMode 为 mask 时完全不需要）；其它图片的模型输入就是原图，立即解码
+    :return: (原图, 缩小解码的模型输入或 None)，失败时返回错误信息
+    """
+    try:
+        # 只读取文件头，解码耗时在 _decode_model_image 和 _load_image 中计入 decode 阶段
+        source = Image.open(BytesIO(image_data))
+    except Exception as e:
+        get_logger("removebg").exception("decode image failed", exc_info=e)
+        return "decode image failed"
+    model_image = _decode_model_image(image_data)
+    if model_image is None:
+        msg = _load_image(source)
+        if msg:
+            return msg
+    return source, model_image
+
+
+def _read_input(dto: RemoveBgDTO, image_data: bytes | None) -> tuple[int, str, bytes]:
+    """
+    检查参数并读取图片字节
+    :return: (code, msg, 图片字节)，code != 0 时图片字节为空
+    """
+    if image_data is None:
+        code, msg = dto.check()
+        if code != 0:
+            return code, msg, b''
+        image_data = _read_image_bytes(dto)
+    else:
+        code, msg = dto.check_output()
+        if code != 0:
+            return code, msg, b''
+    if isinstance(image_data, str):
+        return 200, image_data, b''
+    return 0, '', image_data
+
+
+def remove_background(dto: RemoveBgDTO, image_data: bytes | None = None) \
+        -> tuple[int, str, Image.Image | CacheEntry | str, str]:
+    """
+    去除图片背景，不编码结果
+    :param dto: 请求参数
+    :param image_data: 调用方已经读取好的图片字节（例如 async 接口中已下载的 url），为 None 时按 dto 读取
+    :return: (code, msg, result, cache_key)，code == 0 表示成功；
+             result 为待编码的图片（trim 模式下 info['offset'] 为相对原图的左上角坐标），
+             命中结果缓存时为缓存条目，都交给 encode_result 处理
+    """
+    code, msg, image_data = _read_input(dto, image_data)
     if code != 0:
-        return code, msg, ''
-
-    orig_im: Image.Image | str = _read_image(dto)
-    if isinstance(orig_im, str):
-        return 200, orig_im, ''
-    crop_im = _crop_image_polygon_area(dto, orig_im)
-    # crop_im_path = _save_image_with_random_filename(crop_im)
+        return code, msg, '', ''
+
+    # 相同图片、相同参数直接返回缓存的编码结果，跳过解码、推理和编码
+    cache = get_result_cache()
+    cache_key = content_key(image_data, dto.selectPolygon, dto.editorSize, dto.responseFormat, dto.outputMode,
+                            dto.outputFormat, dto.quality, dto.pngCompressLevel, dto.pngStrategy)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return 0, '', cached, cache_key
+
+    image_key = content_key(image_data) if get_mask_cache() is not None else ''
+    decoded = _decode_images(image_data)
+    del image_data
+    if isinstance(decoded, str):
+        return 200, decoded, '', ''
+    mask, bbox = _select_and_predict(dto, image_key, *decoded)
+    image = None
+    if dto.outputMode != 'mask':
+        image = _crop_source(decoded[0], bbox)
+        if isinstance(image, str):
+            return 200, image, '', ''
+    del decoded
+    # crop_im_path = _save_image_with_random_filename(image)
     # print(f">>>临时文件：{crop_im_path}")
-    result = _remove_background(crop_im)
-    if dto.responseFormat == 0:
-        return 0, '', _save_as_base64(result)
+    left, top = bbox[:2]
+    result = _compose_result(image, mask, dto.outputMode)
+    if 'offset' in result.info:
+        result.info['offset'] = (left + result.info['offset'][0], top + result.info['offset'][1])
+    return 0, '', result, cache_key
+
+
+def encode_result(dto: RemoveBgDTO, result: Image.Image | CacheEntry, cache_key: str = '') \
+        -> tuple[bytes | str, tuple[int, int] | None]:
+    """
+    按 outputFormat 等参数编码结果，responseFormat == 0 时转换为 base64，并写入结果缓存；
+    result 是缓存条目时直接返回
+    :param dto: 请求参数
+    :param result: remove_background 返回的图片或缓存条目
+    :param cache_key: remove_background 返回的缓存键，为空时不写缓存
+    :return: (编码结果, trim 模式下相对原图的左上角坐标，其它模式为 None)
+    """
+    if isinstance(result, Image.Image):
+        offset = result.info.get('offset')
+        with stage('encode'):
+            encoded = encode_image(result, dto.outputFormat, dto.quality, dto.pngCompressLevel, dto.pngStrategy)
+            if dto.responseFormat == 0:
+                encoded = base64.b64encode(encoded)
+        cache = get_result_cache()
+        if cache is not None and cache_key:
+            # trim 模式的坐标放在缓存条目的附加信息中
+            cache.put(cache_key, encoded, {'offset': list(offset)} if offset is not None else None)
     else:
-        return 0, '', _save_as_bytes(result)
-
+        encoded = result.value
+        offset = tuple(result.meta['offset']) if 'offset' in result.meta else None
+    return encoded.decode('ascii') if dto.responseFormat == 0 else encoded, offset
+
+
+def process(dto: RemoveBgDTO, image_data: bytes | None = None) -> tuple[int, str, bytes | str]:
+    """
+    去除图片背景并编码结果
+    :param dto: 请求参数
+    :param image_data: 调用方已经读取好的图片字节（例如 async 接口中已下载的 url），为 None 时按 dto 读取
+    :return: (code, msg, result)，code == 0 表示成功
+    """
+    code, msg, result, cache_key = profiled_call(remove_background, dto, image_data)
+    if code != 0:
+        return code, msg, result
+    return 0, '', profiled_call(encode_result, dto, result, cache_key)[0]
+
+
+def prepare_sunshine(dto: RemoveBgDTO, image_data: bytes | None = None) \
+        -> tuple[int, str, tuple[np.ndarray, np.ndarray] | CacheEntry | str, str]:
+    """
+    光照特效动图的解码和遮罩推理，不渲染帧：遮罩与去除背景共用同一套推理（包括整图遮罩缓存）
+    :param dto: 请求参数
+    :param image_data: 调用方已经读取好的图片字节（例如 async 接口中已下载的 url），为 None 时按 dto 读取
+    :return: (code, msg, result, cache_key)，code == 0 表示成功；
+             result 为裁剪后的 RGB 原图和遮罩，命中结果缓存时为缓存条目，都交给 render_sunshine 处理
+    """
+    code, msg, image_data = _read_input(dto, image_data)
+    if code != 0:
+        return code, msg, '', ''
+
+    cache = get_result_cache()
+    cache_key = content_key(image_data, 'sunshine', dto.selectPolygon, dto.editorSize, dto.responseFormat,
+                            dto.outputFormat == 'webp', dto.quality)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return 0, '', cached, cache_key
+
+    image_key = content_key(image_data) if get_mask_cache() is not None else ''
+    decoded = _decode_images(image_data)
+    del image_data
+    if isinstance(decoded, str):
+        return 200, decoded, '', ''
+    mask, bbox = _select_and_predict(dto, image_key, *decoded)
+    image = _crop_source(decoded[0], bbox)
+    del decoded
+    if isinstance(image, str):
+        return 200, image, '', ''
+    return 0, '', (np.asarray(image), mask), cache_key
+
+
+def render_sunshine(dto: RemoveBgDTO, result: tuple[np.ndarray, np.ndarray] | CacheEntry, cache_key: str = '') \
+        -> bytes | str:
+    """
+    渲染光照特效各帧并编码为 WebP 动图，responseFormat == 0 时转换为 base64，并写入结果缓存；
+    result 是缓存条目时直接返回。outputFormat 为 webp 时无损编码，其它取值按 quality 有损编码；outputMode 不适用
+    :param dto: 请求参数
+    :param result: prepare_sunshine 返回的原图和遮罩或缓存条目
+    :param cache_key: prepare_sunshine 返回的缓存键，为空时不写缓存
+    :return: 编码结果
+    """
+    if isinstance(result, CacheEntry):
+        encoded = result.value
+    else:
+        image, mask = result
+        pool = get_encoder_pool()
+        with stage('sunshine'):
+            # RGB 原图直接得到 RGBA 帧，不需要再转换颜色顺序
+            frames = sunshine(image, mask, True, pool)
+        del image, result
+        with stage('encode'):
+            encoded = create_webp_animation(frames, lossless=dto.outputFormat == 'webp', quality=dto.quality,
+                                            executor=pool)
+            if dto.responseFormat == 0:
+                encoded = base64.b64encode(encoded)
+        cache = get_result_cache()
+        if cache is not None and cache_key:
+            cache.put(cache_key, encoded)
+    return encoded.decode('ascii') if dto.responseFormat == 0 else encoded
+
+
+def sunshine_animation(dto: RemoveBgDTO, image_data: bytes | None = None) -> tuple[int, str, bytes | str]:
+    """
+    生成光照特效的 WebP 动图，结果按图片内容和参数写入结果缓存
+    :param dto: 请求参数
+    :param image_data: 调用方已经读取好的图片字节（例如 async 接口中已下载的 url），为 None 时按 dto 读取
+    :return: (code, msg, result)，code == 0 表示成功，responseFormat == 0 时 result 为 base64 字符串
+    """
+    code, msg, result, cache_key = profiled_call(prepare_sunshine, dto, image_data)
+    if code != 0:
+        return code, msg, result
+    return 0, '', profiled_call(render_sunshine, dto, result, cache_key)
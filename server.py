@@ -1,12 +1,218 @@
-from fastapi import FastAPI
-from fastapi.responses import FileResponse
+import asyncio
+import contextvars
+import json
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi import Response
 
-from removebg import RemoveBgDTO, process
+from PIL import Image
+from pydantic import TypeAdapter, ValidationError
+
+from removebg import RemoveBgDTO, remove_background, encode_result, get_executor, BoundedExecutor, QueueFullError, \
+    get_env_int, get_result_cache, get_mask_cache, get_fetcher, FetchError, get_logger, get_encode_executor, \
+    get_engine_client, media_type, prepare_sunshine, render_sunshine, CacheEntry
+from removebg.logger import dropped_log_records, request_context
+from removebg.metrics import REQUESTS, REQUEST_SECONDS, BATCH_ITEMS, render_metrics, update_process_rss
+from removebg.profiling import current_profile, profile_request, profiled_call, start_profile
+
+# 当前请求的结果 code，由接口写入，RequestMiddleware 读取
+_result_code: contextvars.ContextVar[dict | None] = contextvars.ContextVar('result_code', default=None)
+
+
+def _record_code(code: int):
+    holder = _result_code.get()
+    if holder is not None:
+        # 只记录第一次写入的 code，批量接口的各项不会覆盖整个请求的 code
+        holder.setdefault('code', code)
+
+
+def _request_id(scope) -> str:
+    # 沿用上游（网关、客户端）传入的 X-Request-ID，便于跨系统追踪
+    for name, value in scope['headers']:
+        if name == b'x-request-id':
+            request_id = value.decode('latin-1').strip()
+            if 0 < len(request_id) <= 64:
+                return request_id
+    return uuid.uuid4().hex[:12]
+
+
+class RequestMiddleware:
+    """
+    为每个请求分配请求 ID（日志上下文和 X-Request-ID 响应头），
+    按接口、HTTP 状态码和结果 code 统计请求数与耗时，并记录一行带阶段耗时的访问日志
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._endpoints = None
+
+    def _endpoint(self, scope) -> str:
+        if self._endpoints is None:
+            self._endpoints = {route.path for route in scope['app'].routes if hasattr(route, 'methods')}
+        # 只按已知接口分类，静态文件等路径不产生新的标签
+        path = scope['path'] if scope['path'] in self._endpoints else 'other'
+        return f"{scope['method']} {path}"
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        holder = {}
+        token = _result_code.set(holder)
+        status = 500
+        start = time.perf_counter()
+
+        with request_context(_request_id(scope)) as context:
+            async def send_wrapper(message):
+                nonlocal status
+                if message['type'] == 'http.response.start':
+                    status = message['status']
+                    message['headers'] = [*message.get('headers', []),
+                                          (b'x-request-id', context.request_id.encode('latin-1'))]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                _result_code.reset(token)
+                elapsed = time.perf_counter() - start
+                endpoint = self._endpoint(scope)
+                code = holder.get('code', '')
+                REQUESTS.labels(endpoint, str(status), str(code)).inc()
+                REQUEST_SECONDS.labels(endpoint).observe(elapsed)
+                if endpoint != 'GET other':
+                    _access_log(endpoint, status, code, elapsed, context.timings())
+
+
+def _access_log(endpoint: str, status: int, code: int | str, elapsed: float, timings: dict[str, float]):
+    ms = round(elapsed * 1000, 2)
+    # 成功的请求量大，按 LOG_SAMPLE_RATE 采样；失败的请求总是记录
+    get_logger('removebg.access').info(
+        f"{endpoint} {status} code={code} {ms}ms {timings}",
+        extra={'sampled': status < 400 and code in (0, ''), 'endpoint': endpoint, 'status': status, 'code': code,
+               'ms': ms, 'timings': timings})
+
 
 app = FastAPI()
 app.mount("/assets", StaticFiles(directory="static/assets"), name="assets")
+app.add_middleware(RequestMiddleware)
+
+
+def _busy_response() -> JSONResponse:
+    # 推理队列已满，直接拒绝，提示客户端稍后重试
+    retry_after = get_env_int('RETRY_AFTER_SECONDS', 1)
+    _record_code(300)
+    return JSONResponse(status_code=503, headers={'Retry-After': str(retry_after)},
+                        content={'code': 300, 'msg': 'server is busy, please retry later', 'result': ''})
+
+
+async def _prefetch(dto: RemoveBgDTO) -> tuple[int, str, bytes | None]:
+    """
+    url 请求先异步下载，慢速源站不会占用推理执行器的线程
+    :return: (code, msg, 图片字节)，不是 url 请求时图片字节为 None，由执行器按 dto 读取
+    """
+    if dto.url and not dto.path:
+        code, msg = dto.check()
+        if code != 0:
+            return code, msg, None
+        try:
+            return 0, '', await get_fetcher().fetch_async(dto.url)
+        except FetchError as e:
+            get_logger('removebg').error(str(e))
+            return 200, f"get image from {dto.url} failed", None
+    return 0, '', None
+
+
+async def _submit(executor: BoundedExecutor, wait: bool, fn, *args):
+    """
+    在有界执行器中运行 fn，不阻塞事件循环
+    :param wait: 执行器已满时在服务端等待（批量任务），否则抛出 QueueFullError 由接口返回 503
+    """
+    while True:
+        try:
+            return await asyncio.wrap_future(executor.submit(profiled_call, fn, *args))
+        except QueueFullError:
+            if not wait:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def _process_in_executor(dto: RemoveBgDTO, wait: bool = False) \
+        -> tuple[int, str, bytes | str, tuple[int, int] | None]:
+    code, msg, image_data = await _prefetch(dto)
+    if code != 0:
+        return code, msg, '', None
+    return await _process(dto, image_data, wait)
+
+
+async def _process(dto: RemoveBgDTO, image_data: bytes | None, wait: bool = False) \
+        -> tuple[int, str, bytes | str, tuple[int, int] | None]:
+    # 解码、推理在有界执行器中运行
+    code, msg, result, cache_key = await _submit(get_executor(), wait, remove_background, dto, image_data)
+    if code != 0:
+        return code, msg, result, None
+    if isinstance(result, Image.Image):
+        # 编码在独立的有界执行器中进行，推理执行器的线程可以立即处理下一个请求；
+        # 编码积压时同样拒绝请求，排队等待编码的整图不会无限堆积
+        result, offset = await _submit(get_encode_executor(), wait, encode_result, dto, result, cache_key)
+    else:
+        result, offset = encode_result(dto, result, cache_key)
+    update_process_rss()
+    return code, msg, result, offset
+
+
+async def _read_body(request: Request, max_bytes: int) -> bytes | None:
+    # 流式读取请求体，超过 max_bytes 时返回 None
+    content_length = int(request.headers.get('content-length') or 0)
+    if content_length > max_bytes:
+        return None
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            return None
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def _profile_requested(request: Request, dto: RemoveBgDTO) -> bool:
+    return dto.profile or request.headers.get('X-Profile') == '1'
+
+
+def _make_response(dto: RemoveBgDTO, code: int, msg: str, result: bytes | str, offset: tuple[int, int] | None,
+                   result_type: str = ''):
+    """
+    :param result_type: 结果的 Content-Type，默认由 outputFormat 决定
+    """
+    _record_code(code)
+    # 开启了性能分析的请求附带各阶段耗时
+    profile = current_profile()
+    if code != 0:
+        content = {'code': code, 'msg': msg, 'result': ''}
+        if profile is not None:
+            content['timings'] = profile.timings()
+        return content
+    # 出错时 outputFormat 可能不合法（code 150），只在成功时按它确定 Content-Type
+    result_type = result_type or media_type(dto.outputFormat)
+    if dto.responseFormat == 0:
+        content = {'code': code, 'msg': msg, 'result': f"data:{result_type};base64,{result}"}
+        if offset is not None:
+            content['offset'] = list(offset)
+        if profile is not None:
+            content['timings'] = profile.timings()
+        return content
+    else:
+        headers = {}
+        if offset is not None:
+            # trim 模式下裁剪结果左上角在原图中的坐标
+            headers['X-Image-Offset'] = f"{offset[0]},{offset[1]}"
+        if profile is not None:
+            headers['Server-Timing'] = profile.server_timing()
+        return Response(content=result, media_type=result_type, headers=headers)
 
 
 @app.get("/")
@@ -19,21 +225,173 @@ async def index_html():
     return FileResponse('static/vite.svg')
 
 
+@app.get("/metrics")
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+@app.get("/status")
+async def status():
+    result_cache = get_result_cache()
+    mask_cache = get_mask_cache()
+    engine_client = get_engine_client()
+    return {'executor': get_executor().stats(),
+            'encoder': get_encode_executor().stats(),
+            # 共享推理进程的存活状态，崩溃后由 start.py 重启期间为 false
+            'engines': await asyncio.to_thread(engine_client.status) if engine_client is not None else None,
+            'resultCache': result_cache.stats() if result_cache is not None else None,
+            'maskCache': mask_cache.stats() if mask_cache is not None else None,
+            'logDropped': dropped_log_records()}
+
+
 @app.post("/removebg")
-async def removebg_post(dto: RemoveBgDTO):
-    code, msg, result = process(dto=dto)
+async def removebg_post(dto: RemoveBgDTO, request: Request):
+    with profile_request(start_profile(_profile_requested(request, dto))):
+        try:
+            code, msg, result, offset = await _process_in_executor(dto)
+        except QueueFullError:
+            return _busy_response()
+        return _make_response(dto, code, msg, result, offset)
+
+
+@app.post("/removebg/binary")
+async def removebg_binary(request: Request, selectPolygon: str = '', editorSize: str = '', responseFormat: int = 1,
+                          outputMode: str = 'rgba', outputFormat: str = 'png', quality: int = 80,
+                          pngCompressLevel: int = 6, pngStrategy: str = 'default', profile: bool = False):
+    # 请求体即图片原始字节，省去 base64 编码和 JSON 解析
+    try:
+        dto = RemoveBgDTO.from_query(selectPolygon, editorSize, responseFormat, outputMode=outputMode,
+                                     outputFormat=outputFormat, quality=quality, pngCompressLevel=pngCompressLevel,
+                                     pngStrategy=pngStrategy, profile=profile)
+    except ValueError as e:
+        _record_code(130)
+        return {'code': 130, 'msg': str(e), 'result': ''}
+    code, msg = dto.check_output()
     if code != 0:
+        _record_code(code)
         return {'code': code, 'msg': msg, 'result': ''}
-    if dto.responseFormat == 0:
-        return {'code': code, 'msg': msg, 'result': f"data:image/png;base64,{result}"}
-    else:
-        return Response(content=result, media_type="image/png")
+    max_bytes = get_env_int('UPLOAD_MAX_MB', 30) * 1024 * 1024
+    image_data = await _read_body(request, max_bytes)
+    if image_data is None:
+        _record_code(140)
+        return JSONResponse(status_code=413, content={'code': 140, 'msg': f"image exceeds {max_bytes} bytes", 'result': ''})
+    if not image_data:
+        _record_code(100)
+        return {'code': 100, 'msg': 'request body is empty', 'result': ''}
+    with profile_request(start_profile(_profile_requested(request, dto))):
+        try:
+            code, msg, result, offset = await _process(dto, image_data)
+        except QueueFullError:
+            return _busy_response()
+        return _make_response(dto, code, msg, result, offset)
+
+
+@app.post("/removebg/sunshine")
+async def removebg_sunshine(dto: RemoveBgDTO, request: Request):
+    # 光照特效 WebP 动图，与 /removebg 共用遮罩推理、结果缓存和编码线程池
+    with profile_request(start_profile(_profile_requested(request, dto))):
+        try:
+            code, msg, image_data = await _prefetch(dto)
+            if code == 0:
+                code, msg, result, cache_key = await _submit(get_executor(), False, prepare_sunshine, dto, image_data)
+                if code == 0 and not isinstance(result, CacheEntry):
+                    # 各帧的渲染和动图编码与 /removebg 一样在有界的编码执行器中进行，不占用推理执行器
+                    result = await _submit(get_encode_executor(), False, render_sunshine, dto, result, cache_key)
+                elif code == 0:
+                    result = render_sunshine(dto, result, cache_key)
+            else:
+                result = ''
+        except QueueFullError:
+            return _busy_response()
+        return _make_response(dto, code, msg, result, None, media_type('webp'))
+
+
+async def _batch_item(index: int, dto: RemoveBgDTO) -> str:
+    """
+    处理批量请求中的一项，任何失败都转换为该项的错误行，不影响其它项
+    :return: 一行 JSON
+    """
+    try:
+        with profile_request(start_profile(dto.profile)):
+            # 执行器已满时在服务端等待，批量任务不返回 503
+            code, msg, result, offset = await _process_in_executor(dto, wait=True)
+            line = _make_response(dto, code, msg, result, offset)
+    except Exception as e:
+        get_logger('removebg').exception(f"batch item {index} failed", exc_info=e)
+        code = 500
+        line = {'code': code, 'msg': f"process failed: {e}", 'result': ''}
+    BATCH_ITEMS.labels(str(code)).inc()
+    line['index'] = index
+    return json.dumps(line, ensure_ascii=False) + '\n'
+
+
+async def _batch_lines(dtos: list[RemoveBgDTO | None], concurrency: int):
+    """
+    并发处理批量请求中的各项，每完成一项就输出一行 JSON（NDJSON）。
+    只有 concurrency 个协程在处理，已输出的结果和已处理项的参数（包括 base64）都会立即释放，
+    内存占用不随批量大小增长；各项的推理经由微批调度器（或共享推理进程）与其它请求一起堆叠成批次
+    """
+    lines: asyncio.Queue[str] = asyncio.Queue(maxsize=concurrency)
+    indexes = iter(range(len(dtos)))
+
+    async def worker():
+        # 各协程共用同一个下标迭代器，事件循环是单线程的，不需要加锁
+        for index in indexes:
+            dto, dtos[index] = dtos[index], None
+            await lines.put(await _batch_item(index, dto))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(dtos)))]
+    try:
+        for _ in range(len(dtos)):
+            yield await lines.get()
+    finally:
+        # 客户端断开时取消尚未完成的项
+        for task in workers:
+            task.cancel()
+
+
+_batch_adapter = TypeAdapter(list[RemoveBgDTO])
+
+
+@app.post("/removebg/batch")
+async def removebg_batch(request: Request):
+    # 先限制请求体大小再解析，base64 图片很多时不会一次性占用大量内存
+    max_bytes = get_env_int('BATCH_MAX_MB', 64) * 1024 * 1024
+    body = await _read_body(request, max_bytes)
+    if body is None:
+        _record_code(140)
+        return JSONResponse(status_code=413, content={'code': 140, 'msg': f"batch exceeds {max_bytes} bytes",
+                                                      'result': ''})
+    try:
+        dtos = _batch_adapter.validate_json(body)
+    except ValidationError as e:
+        _record_code(130)
+        return JSONResponse(status_code=422, content={'code': 130, 'msg': str(e), 'result': ''})
+    del body
+    max_items = get_env_int('BATCH_MAX_ITEMS', 100)
+    if len(dtos) > max_items:
+        _record_code(160)
+        return JSONResponse(status_code=413, content={'code': 160, 'msg': f"batch exceeds {max_items} items",
+                                                      'result': ''})
+    for dto in dtos:
+        # 每行都是 JSON，结果统一为 base64
+        dto.responseFormat = 0
+    concurrency = get_env_int('BATCH_CONCURRENCY', 0)
+    if concurrency <= 0:
+        concurrency = get_executor().max_workers
+    # 各项的 code 单独统计在 removebg_batch_items_total 中
+    _record_code(0)
+    return StreamingResponse(_batch_lines(dtos, concurrency), media_type='application/x-ndjson')
 
 
 @app.get("/removebg")
-async def removebg_get(url: str):
-    dto = RemoveBgDTO(url=url, responseFormat=1)
-    code, msg, result = process(dto=dto)
-    if code != 0:
-        return {'code': code, 'msg': msg, 'result': ''}
-    return Response(content=result, media_type="image/png")
+async def removebg_get(request: Request, url: str, outputMode: str = 'rgba', outputFormat: str = 'png',
+                       profile: bool = False):
+    dto = RemoveBgDTO(url=url, responseFormat=1, outputMode=outputMode, outputFormat=outputFormat, profile=profile)
+    with profile_request(start_profile(_profile_requested(request, dto))):
+        try:
+            code, msg, result, offset = await _process_in_executor(dto)
+        except QueueFullError:
+            return _busy_response()
+        return _make_response(dto, code, msg, result, offset)
@@ -1,18 +1,46 @@
+import glob
+import multiprocessing
 import os
 import sys
+import tempfile
 import webbrowser
 
+from dotenv import load_dotenv
+
+
+def clear_metrics_dir():
+    """
+    删除指标目录中的文件：上次运行（包括被强制结束的运行）留下的指标不会混入本次的 /metrics
+    """
+    for path in glob.glob(os.path.join(os.environ['PROMETHEUS_MULTIPROC_DIR'], '*.db')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    # 各个 HTTP 进程和共享推理进程的指标写入同一个目录，由 /metrics 汇总；必须在导入 server 之前设置并清空。
+    # 只在主进程中进行，spawn 启动的子进程会重新执行本文件，继承已设置的环境变量。
+    # 未配置时使用临时目录下按端口区分的固定目录，每次启动复用，不会逐次堆积
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = os.path.join(
+            tempfile.gettempdir(), f"removebg-metrics-{os.environ.get('HTTP_SERVER_PORT') or 10086}")
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+    clear_metrics_dir()
+
 import psutil
 from uvicorn import run
-from dotenv import load_dotenv
 import server
+from removebg import start_engines, stop_engines
 
 
 if sys.platform == "win32":
     os.system('chcp 65001')
 
 if __name__ == "__main__":
-    load_dotenv()
+    multiprocessing.freeze_support()
     port_str = os.environ.get('HTTP_SERVER_PORT')
     port = int(port_str) if port_str else 10086
     worker_count = int(os.environ.get('UVICORN_WORKERS'))
@@ -22,6 +50,12 @@ if __name__ == "__main__":
             worker_count = int(cpu_cores)
     if worker_count <= 0:
         worker_count = 1
-    run(app="server:app", host="0.0.0.0", port=port, workers=worker_count)
+    # 先启动共享推理进程，HTTP 进程只负责读图和编码，不再各自加载模型；推理进程退出后会被自动重启
+    engines = start_engines()
+    try:
+        run(app="server:app", host="0.0.0.0", port=port, workers=worker_count)
+    finally:
+        stop_engines(engines)
+        clear_metrics_dir()
 
     input("...exit with enter")
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from removebg.bulk import collect_sources
+
+
+class CollectSourcesTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.root = self._dir.name
+        for path in ('a/x.jpg', 'a/x.png', 'b/x.jpg', 'b/c/y.webp'):
+            path = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(b'0')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def names(self, source: str) -> list[str]:
+        return [name.replace(os.sep, '/') for _, name in collect_sources(source)]
+
+    def test_directory_keeps_subdirectories_and_suffixes_duplicates(self):
+        self.assertEqual(self.names(self.root), ['a/x', 'a/x-1', 'b/c/y', 'b/x'])
+
+    def test_glob_is_relative_to_its_root(self):
+        pattern = os.path.join(self.root, '**', '*.jpg')
+        self.assertEqual(self.names(pattern), ['a/x', 'b/x'])
+
+    def test_list_file_hashes_urls_and_keeps_local_subdirectories(self):
+        list_file = os.path.join(self.root, 'list.txt')
+        with open(list_file, 'w', encoding='utf-8') as file:
+            file.write('# comment\n')
+            file.write(os.path.join(self.root, 'a', 'x.jpg') + '\n')
+            file.write(os.path.join(self.root, 'b', 'x.jpg') + '\n')
+            file.write('https://example.com/1/image.jpg\n')
+            file.write('https://example.com/2/image.jpg?size=large\n')
+        names = self.names(list_file)
+        self.assertEqual(names[:2], ['a/x', 'b/x'])
+        self.assertTrue(names[2].startswith('image-') and names[3].startswith('image-'))
+        self.assertNotEqual(names[2], names[3])
+        # 重新运行时文件名不变，可以跳过已完成的输出
+        self.assertEqual(self.names(list_file), names)
+
+
+if __name__ == '__main__':
+    unittest.main()
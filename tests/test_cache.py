@@ -0,0 +1,34 @@
+import unittest
+
+import numpy as np
+
+from removebg.cache import MaskCache, content_key
+from removebg.composite import resize_mask
+
+
+class ContentKeyTest(unittest.TestCase):
+
+    def test_array_shape_and_dtype_are_part_of_the_key(self):
+        array = np.arange(6, dtype=np.uint8).reshape(2, 3)
+        self.assertEqual(content_key(array), content_key(array.copy()))
+        self.assertNotEqual(content_key(array), content_key(array.reshape(3, 2)))
+        self.assertNotEqual(content_key(array), content_key(array.view(np.int8)))
+
+
+class MaskCacheTest(unittest.TestCase):
+
+    def test_hit_matches_upsampled_model_mask(self):
+        cache = MaskCache(1024 * 1024, model_size=(16, 16))
+        model_mask = np.random.default_rng(0).integers(0, 256, (16, 16), dtype=np.uint8)
+        cache.put('key', model_mask)
+        # 命中时与未命中时一样，从模型分辨率的遮罩放大一次
+        np.testing.assert_array_equal(cache.get('key', (40, 30)), resize_mask(model_mask, (40, 30)))
+
+    def test_rejects_full_resolution_mask(self):
+        cache = MaskCache(1024 * 1024, model_size=(16, 16))
+        with self.assertRaises(ValueError):
+            cache.put('key', np.zeros((40, 30), dtype=np.uint8))
+
+
+if __name__ == '__main__':
+    unittest.main()
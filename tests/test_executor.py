@@ -0,0 +1,42 @@
+import threading
+import unittest
+
+from removebg.executor import BoundedExecutor, QueueFullError
+
+
+class BoundedExecutorTest(unittest.TestCase):
+
+    def test_cancel_queued_future_releases_slot(self):
+        executor = BoundedExecutor(1, 1)
+        release = threading.Event()
+        try:
+            running = executor.submit(release.wait, 10)
+            queued = executor.submit(lambda: None)
+            with self.assertRaises(QueueFullError):
+                executor.submit(lambda: None)
+
+            self.assertTrue(queued.cancel())
+            self.assertEqual(executor.stats()['queued'], 0)
+            # 取消的任务归还了名额，可以继续提交
+            again = executor.submit(lambda: 'ok')
+            release.set()
+            self.assertTrue(running.result(timeout=10))
+            self.assertEqual(again.result(timeout=10), 'ok')
+        finally:
+            release.set()
+            executor.shutdown()
+        stats = executor.stats()
+        self.assertEqual((stats['queued'], stats['running'], stats['completed']), (0, 0, 2))
+
+    def test_failed_task_releases_slot(self):
+        executor = BoundedExecutor(1, 0)
+        try:
+            with self.assertRaises(ZeroDivisionError):
+                executor.submit(lambda: 1 / 0).result(timeout=10)
+            self.assertEqual(executor.submit(lambda: 'ok').result(timeout=10), 'ok')
+        finally:
+            executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()